@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Measures how `--io-jobs` hides filesystem latency while applying a plan.
+
+A network mount makes every metadata operation wait for a round trip. To show
+the effect without one, the functions of the `os` module which create, remove
+or inspect files are wrapped to sleep for `--latency-ms` before doing their
+work in a temporary directory. Planning happens before the shim is installed,
+so only the apply step is timed.
+"""
+
+import argparse
+import contextlib
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ep_rename
+
+SHIMMED = ['symlink', 'link', 'unlink', 'rename', 'stat', 'lstat']
+
+@contextlib.contextmanager
+def latency(seconds):
+    """Makes every call to the functions in `SHIMMED` take `seconds` longer.
+    The sleep releases the GIL like a blocking syscall does."""
+    originals = {name: getattr(os, name) for name in SHIMMED}
+
+    def shim(func):
+        def wrapper(*args, **kwargs):
+            time.sleep(seconds)
+            return func(*args, **kwargs)
+        return wrapper
+
+    for name, func in originals.items():
+        setattr(os, name, shim(func))
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            setattr(os, name, func)
+
+def run(count, output_type, io_jobs, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / 'source'
+        source.mkdir()
+        for i in range(count):
+            (source / 'show - {:04d}.mkv'.format(i + 1)).touch()
+        plan = ep_rename.plan(source, title='Show', output_type=output_type,
+                              io_jobs=io_jobs)
+        with latency(seconds):
+            start = time.perf_counter()
+            ep_rename.apply(plan)
+            elapsed = time.perf_counter() - start
+        created = sum(1 for p in source.iterdir() if p.name.startswith('Show '))
+        if created != count:
+            raise RuntimeError('created {} of {} files'.format(created, count))
+        return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    parser.add_argument('--io-jobs', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--output-type', nargs='+', default=['symlink', 'hardlink'])
+    args = parser.parse_args()
+
+    seconds = args.latency_ms / 1e3
+    print('{} files, {} ms per operation'.format(args.count, args.latency_ms))
+    for output_type in args.output_type:
+        baseline = None
+        for io_jobs in args.io_jobs:
+            elapsed = run(args.count, output_type, io_jobs, seconds)
+            baseline = baseline or elapsed
+            print('  {:<9} --io-jobs {:<3} {:8.3f} s   ({:.1f}x)'
+                  .format(output_type, io_jobs, elapsed, baseline / elapsed))
+
+if __name__ == '__main__':
+    main()
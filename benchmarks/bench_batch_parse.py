@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Compares parsing file names one by one against parsing them in a batch.
+
+The per-file path builds a `Path` for every name and matches the `--input-fmt`
+regex against each of them, like `plan` does with `--index`. The batch path
+joins the names into one buffer and scans it with a single `finditer`, only
+building objects for the names which match. Both must extract the same
+fields from the same files.
+
+Most of the difference comes from the names which don't match, so it grows
+with `--unmatched`.
+"""
+
+import argparse
+import gc
+import os
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ep_rename
+
+def generate_names(count, unmatched, seed):
+    """Returns `count` names resembling a flattened archive dump, of which
+    roughly the fraction `unmatched` don't match the default format."""
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        if rng.random() < unmatched:
+            names.append('[Group] notes {}.nfo'.format('x' * rng.randint(1, 40)))
+        else:
+            names.append('[Group] show {} - {:04d} [1080p][{:08X}].mkv'
+                         .format(i % 97, i, rng.getrandbits(32)))
+    return names
+
+def fields(inputs):
+    return sorted((str(i.file), i.fmt, i.number.season, i.number.episode, i.suffix)
+                  for i in inputs)
+
+def best_time(func, repeat):
+    """Like `timeit`, the garbage collector is disabled while timing, since
+    its passes over the many objects created dominate the differences."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, nargs='+', default=[1000, 50000, 200000])
+    parser.add_argument('--unmatched', type=float, default=0.2,
+                        help='fraction of names which don\'t match')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    options = ep_rename.argparser.parse_args(['-t', 'bench'])
+    ep_rename.validate_args(options)
+    program = ep_rename.Program(options, Path('/bench'))
+    # the warnings about skipped files are written as in a real run, but
+    # not to the terminal
+    program.logger.stream = open(os.devnull, 'w')
+
+    ok = True
+    for count in args.count:
+        names = generate_names(count, args.unmatched, args.seed)
+
+        def per_file():
+            files = [program.source / name for name in names]
+            return [i for i in map(program.extract_input, files) if i is not None]
+
+        per_file_s, expected = best_time(per_file, args.repeat)
+        batch_s, actual = best_time(lambda: list(program.extract_inputs(names)),
+                                   args.repeat)
+        if fields(expected) != fields(actual):
+            print('error: batch parsing differs from per-file parsing for {} names'
+                  .format(count), file=sys.stderr)
+            ok = False
+        print('{:>8} names: per-file {:8.1f} ms   batch {:8.1f} ms   ({:.2f}x)'
+              .format(count, per_file_s * 1e3, batch_s * 1e3, per_file_s / batch_s))
+
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Fuzzes and benchmarks the regexes compiled from `--input-fmt` formats.
+
+The fuzzing part matches random short names against both the compiled regex
+and the naive translation the compiler used to emit, and checks that they
+agree on whether the name matches and on every captured field.
+
+The benchmark part times adversarial names, which are long, bracket heavy and
+mostly don't match, and reports the worst time per name. It exits with an
+error if any name takes longer than `--max-ms` with the compiled regex.
+"""
+
+import argparse
+from pathlib import Path
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ep_rename
+
+# formats whose `%b` is followed by a wildcard, where the compiled regex is
+# exactly equivalent to the naive one
+FORMATS = [
+    '%b%a%n%a.%f',
+    '%b%a_r2_%n%a.%f',
+    '%a%A%n%a.%f',
+    '%b%a - %n%a.%f',
+    '%a%n',
+    '%a %n%A.%f',
+    '%a - %n%A.%f',
+    '%n%A%n.%f',
+]
+
+def naive_regex(fmt):
+    """The translation `construct_input_fmt` used before it was made safe."""
+    regex = ''
+    for token in ep_rename.parse_input_fmt(fmt):
+        if token == 'a':
+            regex += r'.*?'
+        elif token == 'A':
+            regex += r'.+?'
+        elif token == 'b':
+            regex += r'(?:\[.*?\])*'
+        elif token == 'n':
+            regex += '((?:[sS][0-9]+[eE][0-9]+)|(?:[0-9]+))'
+        elif token == 'f':
+            regex += r'([^\.]+)$'
+        else:
+            regex += ep_rename.escape_literal(token)
+    return re.compile(regex)
+
+def adversarial_names(length):
+    return {
+        'brackets': '[]' * (length // 2) + 'x',
+        'unclosed': '[' * length,
+        'digits': '1 ' * (length // 2),
+        'no suffix': '[Group] show - ' + '0' * (length - 15),
+        'dots': '1.' * (length // 2),
+        'mixed': ('[a]1.' * length)[:length],
+        'seasons': ('s1e1x' * length)[:length],
+    }
+
+def fuzz(iterations, seed):
+    rng = random.Random(seed)
+    alphabet = '[]._- 0123sSeEx'
+    for fmt in FORMATS:
+        safe, _ = ep_rename.compile_input_fmt(fmt)
+        naive = naive_regex(fmt)
+        for _ in range(iterations):
+            name = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+            a = safe.fullmatch(name)
+            b = naive.fullmatch(name)
+            if (a and a.groups()) != (b and b.groups()):
+                print('error: {!r} differs for {!r}: {!r} != {!r}'
+                      .format(fmt, name, a and a.groups(), b and b.groups()),
+                      file=sys.stderr)
+                return False
+    print('fuzz: {} formats x {} names agree'.format(len(FORMATS), iterations))
+    return True
+
+def worst_time(regex, names, repeat):
+    worst = 0
+    for name in names:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            regex.fullmatch(name)
+        worst = max(worst, (time.perf_counter() - start) / repeat)
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--length', type=int, default=200,
+                        help='length of the adversarial names')
+    parser.add_argument('--naive-length', type=int, default=40,
+                        help='length of the adversarial names given to the '
+                             'naive regex, which may take very long otherwise')
+    parser.add_argument('--max-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    ok = fuzz(args.iterations, args.seed)
+
+    for fmt in FORMATS:
+        safe, _ = ep_rename.compile_input_fmt(fmt)
+        names = adversarial_names(args.length)
+        print('{!r}:'.format(fmt))
+        for kind, name in names.items():
+            ms = worst_time(safe, [name], 10) * 1e3
+            naive_ms = worst_time(naive_regex(fmt),
+                                  [adversarial_names(args.naive_length)[kind]], 1) * 1e3
+            print('  {:<10} {:8.3f} ms at {} chars   (naive: {:8.3f} ms at {} chars)'
+                  .format(kind, ms, args.length, naive_ms, args.naive_length))
+            if ms > args.max_ms:
+                print('error: matching took longer than {} ms'.format(args.max_ms),
+                      file=sys.stderr)
+                ok = False
+
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
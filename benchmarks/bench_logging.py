@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Measures what messages cost while planning, at each verbosity.
+
+Planning calls `Program.log` several times per file. Messages are formatted
+only at the levels which show them, so `-v` should cost little more than the
+default verbosity, and with `-vv` writing them in batches should keep the cost
+low. Standard error is redirected to a pipe read by `cat`, line
+buffered like standard error, as when messages are sent to a log collector.
+The names are given to `plan` directly, so no files are created.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ep_rename
+import generate_library
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    names = list(generate_library.generate_names(args.count, args.seed))
+    runs = [('default', 0, 'text'), ('-v', 1, 'text'),
+            ('-vv', 2, 'text'), ('-vv json', 2, 'json')]
+    collector = subprocess.Popen(['cat'], stdin=subprocess.PIPE,
+                                 stdout=subprocess.DEVNULL)
+    log = io.TextIOWrapper(collector.stdin, line_buffering=True)
+    with tempfile.TemporaryDirectory() as directory:
+        for label, verbose, log_format in runs:
+            def run():
+                with contextlib.redirect_stderr(log):
+                    ep_rename.plan(directory, entries=names, title='Show', verbose=verbose,
+                                   log_format=log_format, resolve_overlaps='any')
+
+            seconds = best_time(run, args.repeat)
+            print('{:>10}: {:8.1f} ms'.format(label, seconds * 1e3))
+    log.close()
+    collector.wait()
+
+if __name__ == '__main__':
+    main()
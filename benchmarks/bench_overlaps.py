@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Checks that `Program.check_overlaps` scales linearly with the number of
+colliding inputs.
+
+Synthetic inputs are generated in memory such that every destination is shared
+by a few sources, then resolved with `--resolve-overlaps any`. The time per
+input should stay roughly constant as the number of inputs grows; the script
+exits with an error if it grows by more than `--max-ratio` between the smallest
+and the largest size.
+"""
+
+import argparse
+from pathlib import Path
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ep_rename
+
+def make_inputs(n, sources_per_dest):
+    inputs = []
+    for i in range(n):
+        episode = str(i // sources_per_dest + 1)
+        input = ep_rename.Input(
+            Path('[Group{}] show - {}.mkv'.format(i % sources_per_dest, episode)))
+        input.number = ep_rename.Number(None, episode)
+        input.suffix = 'mkv'
+        input.dest = Path('Show {}.mkv'.format(episode))
+        inputs.append(input)
+    return inputs
+
+def bench(n, sources_per_dest):
+    args = ep_rename.argparser.parse_args(['-t', 'Show', '--resolve-overlaps', 'any'])
+    ep_rename.validate_args(args)
+    program = ep_rename.Program(args)
+    inputs = make_inputs(n, sources_per_dest)
+    start = time.perf_counter()
+    program.check_overlaps(inputs)
+    elapsed = time.perf_counter() - start
+    assert len(inputs) == -(-n // sources_per_dest)
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated numbers of inputs to try')
+    parser.add_argument('--sources-per-dest', type=int, default=3)
+    parser.add_argument('--max-ratio', type=float, default=4.0,
+                        help='largest allowed growth of the time per input')
+    args = parser.parse_args()
+
+    per_input = []
+    for n in map(int, args.sizes.split(',')):
+        elapsed = bench(n, args.sources_per_dest)
+        per_input.append(elapsed / n)
+        print('{:>9} inputs: {:8.3f} s  {:8.0f} ns/input'
+              .format(n, elapsed, elapsed / n * 1e9))
+
+    ratio = per_input[-1] / per_input[0]
+    print('growth of time per input: {:.2f}x'.format(ratio))
+    if ratio > args.max_ratio:
+        print('error: check_overlaps does not scale linearly', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
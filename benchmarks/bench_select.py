@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Compares sorting all inputs against selecting the window of `--first`.
+
+`plan` used to sort every matched file before slicing out `--skip` and
+`--first`. Now the inputs stream from extraction into a heap holding only the
+files up to the end of the window. Both must select the same inputs in the
+same order, including among files with equal numbers.
+"""
+
+import argparse
+import gc
+import os
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ep_rename
+
+def generate_names(count, seed):
+    """Returns `count` names with some episode numbers appearing repeatedly."""
+    rng = random.Random(seed)
+    return ['[Group{}] show - {:d} [{:08X}].mkv'.format(i % 7, rng.randint(1, count // 2 + 1),
+                                                       rng.getrandbits(32))
+            for i in range(count)]
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, nargs='+', default=[10000, 200000])
+    parser.add_argument('--first', type=int, default=13)
+    parser.add_argument('--skip', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    options = ep_rename.argparser.parse_args(['-t', 'bench'])
+    ep_rename.validate_args(options)
+    program = ep_rename.Program(options, Path('/bench'))
+    program.logger.stream = open(os.devnull, 'w')
+    stop = args.skip + args.first
+
+    ok = True
+    for count in args.count:
+        names = generate_names(count, args.seed)
+
+        def full_sort():
+            inputs = list(program.extract_inputs(names))
+            ep_rename.sort_inputs_by_num(inputs)
+            return inputs[args.skip:stop]
+
+        def select():
+            inputs, _ = ep_rename.select_inputs_by_num(program.extract_inputs(names), stop)
+            return inputs[args.skip:]
+
+        sort_s, expected = best_time(full_sort, args.repeat)
+        select_s, actual = best_time(select, args.repeat)
+        if [i.file for i in expected] != [i.file for i in actual]:
+            print('error: selection differs from sorting for {} names'.format(count),
+                  file=sys.stderr)
+            ok = False
+        print('{:>8} names: sort {:8.1f} ms   select {:8.1f} ms   ({:.2f}x)'
+              .format(count, sort_s * 1e3, select_s * 1e3, sort_s / select_s))
+
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
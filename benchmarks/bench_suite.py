@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Times every stage of `Program` on synthetic libraries of several sizes.
+
+For each size, a child process generates a library with `generate_library.py`
+on a tmpfs, plans it and applies it as symbolic links into a second
+directory, and reports the wall time of each phase recorded by `--stats`
+along with the peak memory of the run. Running each size in its own process
+keeps the peak memory of one size from hiding that of the next.
+
+Each size needs about twice as many free inodes as files on the tmpfs, for
+the sources and the links; remount it with a larger `nr_inodes` or pass
+another `--dir` if 1M files don't fit.
+
+The results are written as a JSON document. Given `--baseline`, a previous
+document, the script exits with an error if any stage got slower or the peak
+memory grew by more than `--tolerance`.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ep_rename
+import generate_library
+
+# stages faster than this are too noisy to compare against a baseline
+MIN_SECONDS = 0.05
+
+def reset_peak_memory():
+    """Lets the peak memory reflect only what follows, where Linux allows."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_memory_kib():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_size(count, directory, seed):
+    """Benchmarks a single size in this process and returns its results."""
+    root = tempfile.mkdtemp(prefix='ep_rename_bench_', dir=directory)
+    try:
+        source = os.path.join(root, 'source')
+        destination = os.path.join(root, 'destination')
+        os.mkdir(destination)
+        start = time.perf_counter()
+        generate_library.create_files(source, generate_library.generate_names(count, seed))
+        generate_seconds = time.perf_counter() - start
+
+        args = ep_rename.argparser.parse_args(
+            ['-t', 'Show', '-d', destination, '--resolve-overlaps', 'any'])
+        ep_rename.validate_args(args)
+        reset_peak_memory()
+        program = ep_rename.Program(args, Path(source))
+        # warnings about the names which aren't episodes are written as in a
+        # real run, but not to the terminal
+        program.logger.stream = open(os.devnull, 'w')
+        start = time.perf_counter()
+        program.apply(program.plan())
+        program.logger.flush()
+        total_seconds = time.perf_counter() - start
+        peak_kib = peak_memory_kib()
+    finally:
+        shutil.rmtree(root)
+
+    return {
+        'count': count,
+        'generate_seconds': round(generate_seconds, 6),
+        'total_seconds': round(total_seconds, 6),
+        'files_per_second': round(count / total_seconds) if total_seconds else None,
+        'peak_memory_kib': peak_kib,
+        'stages': {name: {'calls': calls, 'seconds': round(seconds, 6)}
+                   for name, (calls, seconds) in program.stats.phases.items()},
+        'counters': program.stats.counters,
+    }
+
+def compare(results, baseline, tolerance):
+    """Returns descriptions of the regressions of `results` from `baseline`."""
+    regressions = []
+    previous = {size['count']: size for size in baseline['sizes']}
+    for size in results['sizes']:
+        old = previous.get(size['count'])
+        if not old:
+            continue
+        pairs = [('total', size['total_seconds'], old['total_seconds'])]
+        pairs += [(name, stage['seconds'], old['stages'][name]['seconds'])
+                  for name, stage in size['stages'].items() if name in old['stages']]
+        for name, seconds, old_seconds in pairs:
+            if seconds > MIN_SECONDS and seconds > old_seconds * (1 + tolerance):
+                regressions.append('{} files: {} took {:.3f}s, was {:.3f}s'
+                                   .format(size['count'], name, seconds, old_seconds))
+        if size['peak_memory_kib'] > old['peak_memory_kib'] * (1 + tolerance):
+            regressions.append('{} files: peak memory was {} KiB, was {} KiB'
+                               .format(size['count'], size['peak_memory_kib'],
+                                       old['peak_memory_kib']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--dir', default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                        help='where to generate the libraries, ideally a tmpfs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this file instead of '
+                                         'standard output')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='the fraction by which a stage may get slower')
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        print(json.dumps(run_size(args.run_size, args.dir, args.seed)))
+        return
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dir': args.dir,
+        'sizes': [],
+    }
+    for count in args.sizes:
+        command = [sys.executable, __file__, '--run-size', str(count), '--seed', str(args.seed)]
+        if args.dir:
+            command += ['--dir', args.dir]
+        child = subprocess.run(command, stdout=subprocess.PIPE)
+        if child.returncode:
+            sys.exit('error: benchmarking {} files failed'.format(count))
+        size = json.loads(child.stdout)
+        results['sizes'].append(size)
+        print('{:>8} files: {:8.3f}s  {:>9} files/s  {:>8} KiB peak'
+              .format(count, size['total_seconds'], size['files_per_second'],
+                      size['peak_memory_kib']), file=sys.stderr)
+
+    document = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Generates a synthetic directory of episode files for benchmarking.
+
+The names mimic what accumulates in a flattened download directory: fansub
+releases with bracketed group, resolution and checksum tags, scene releases
+with season markers, plain underscore names, and some files which aren't
+episodes at all. A fraction of the episodes is present more than once from
+different groups, so their outputs collide and `--resolve-overlaps` is
+exercised. The same seed always produces the same names.
+
+The files are empty, so put the directory on a tmpfs such as /dev/shm to
+measure the program rather than the disk.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+GROUPS = ['HorribleSubs', 'Erai-raws', 'SubsPlease', 'a-s', 'Coalgirls', 'gg',
+          'Commie', 'FFF', 'Underwater', 'Doki']
+TITLES = ['Code Geass', 'Fullmetal Alchemist Brotherhood', 'Mushishi', 'Haikyuu',
+          'Cowboy Bebop', 'Steins Gate', 'Hyouka', 'Monster', 'Planetes',
+          'The Wire', 'Dragon Ball', 'Kaiba', 'Mononoke', 'Texhnolyze']
+RESOLUTIONS = ['480p', '720p', '1080p', 'BD 1080p', 'WEB-DL 1080p']
+SUFFIXES = ['mkv', 'mkv', 'mkv', 'mp4', 'avi']
+
+def fansub_name(rng, group, title, episode):
+    return '[{}] {} - {:02d} [{}][{:08X}].{}'.format(
+        group, title, episode, rng.choice(RESOLUTIONS), rng.getrandbits(32),
+        rng.choice(SUFFIXES))
+
+def scene_name(rng, group, title, episode):
+    # episodes are split into seasons of 26
+    return '{}.S{:02d}E{:02d}.{}.x264-{}.{}'.format(
+        title.replace(' ', '.'), episode // 26 + 1, episode % 26 + 1,
+        rng.choice(RESOLUTIONS).replace(' ', '.'), group.upper(),
+        rng.choice(SUFFIXES))
+
+def underscore_name(rng, group, title, episode):
+    return '[{}]_{}_-_{:02d}_[{}].{}'.format(
+        group.lower(), title.lower().replace(' ', '_'), episode,
+        rng.choice(RESOLUTIONS).replace(' ', '_'), rng.choice(SUFFIXES))
+
+STYLES = [fansub_name, fansub_name, scene_name, underscore_name]
+
+def generate_names(count, seed=0, collisions=0.05, junk=0.05):
+    """Yields `count` distinct names. About the fraction `collisions` of them
+    are another release of an episode yielded before, and `junk` of them don't
+    name an episode."""
+    rng = random.Random(seed)
+    seen = set()
+    episodes = []
+    while len(seen) < count:
+        r = rng.random()
+        if r < junk:
+            name = '{} {}.{}'.format(rng.choice(TITLES), rng.choice(['notes', 'readme', 'cover']),
+                                     'x' * rng.randint(1, 8) + rng.choice(['nfo', 'txt', 'jpg']))
+        else:
+            if r < junk + collisions and episodes:
+                episode, style = rng.choice(episodes)
+            else:
+                episode, style = len(episodes) + 1, rng.choice(STYLES)
+                episodes.append((episode, style))
+            name = style(rng, rng.choice(GROUPS), rng.choice(TITLES), episode)
+        if name not in seen:
+            seen.add(name)
+            yield name
+
+def create_files(directory, names):
+    """Creates an empty file in `directory` for each name. Returns the number
+    of files created."""
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for name in names:
+        os.close(os.open(os.path.join(directory, name),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('directory')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--collisions', type=float, default=0.05)
+    parser.add_argument('--junk', type=float, default=0.05)
+    args = parser.parse_args()
+
+    if os.path.exists(args.directory) and os.listdir(args.directory):
+        sys.exit('error: {!r} is not empty'.format(args.directory))
+    created = create_files(args.directory, generate_names(args.count, args.seed,
+                                                          args.collisions, args.junk))
+    print('created {} files in {!r}'.format(created, args.directory))
+
+if __name__ == '__main__':
+    main()
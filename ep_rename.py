@@ -21,14 +21,42 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 import argparse
-from pathlib import Path
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import ctypes
+import ctypes.util
+import errno
+import functools
+import hashlib
+import heapq
+import json
+import mmap
+import os
+from pathlib import Path, PurePath
 import re
 import sys
 import shutil
+import sqlite3
+import stat
+import struct
+import threading
+import time
+import urllib.parse
+import weakref
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+OUTPUT_TYPES = ['symlink', 'hardlink', 'reflink', 'copy', 'move']
 
 argparser = argparse.ArgumentParser(
     description='Canonicalizes episode filenames using symbolic links',
-    usage='ep_rename.py [OPTIONS] -t TITLE',
+    usage='ep_rename.py [OPTIONS] -t TITLE\n' +
+          '       ep_rename.py [OPTIONS] --library DIR\n' +
+          '       ep_rename.py [OPTIONS] --manifest FILE\n' +
+          '       ep_rename.py [OPTIONS] --apply FILE',
     epilog='''
 INPUT FORMAT
     When traversing the current directory, file names are matched against the
@@ -36,6 +64,9 @@ INPUT FORMAT
     kept and the desired fields are extracted. Files whose name do not match
     are ignored.
 
+    When `--input-fmt` is given more than once, the formats are tried in the
+    order given and the first one which matches is used.
+
     A format string consists of sequence of literal characters and pattern
     groups which begin with a `%`. Some pattern groups capture their matched
     data which is used to determine metadata fields from the file name, such
@@ -46,7 +77,8 @@ INPUT FORMAT
     %A  Matches any positive-length sequence of characters.
 
     %b  Optionally matches multiple pairs of square bracket and the content
-        between them. Cannot handle nested brackets.
+        between them. Each pair ends at the first `]`, so nested brackets
+        are not supported.
 
     %n  Matches and captures a general episode number, which may or may not
         specify a season number. If it specifies a season number, it must
@@ -75,6 +107,34 @@ EXAMPLES
         ./Fullmetal Alchemist Brotherhood 02.mkv
         ./Fullmetal Alchemist Brotherhood 03.mkv
         ...
+
+LIBRARY MODE
+    Passing `--library DIR` walks the whole tree below DIR and treats every
+    leaf directory (one without subdirectories) as its own show. The title of
+    each show is the name of its directory and the output files are created
+    inside that directory. Shows are processed in parallel; see `--jobs`.
+    To process the library again later, for example nightly, pass `--sync`
+    or `--index` every time, as otherwise the outputs of the earlier passes
+    are taken for new files.
+
+MANIFEST MODE
+    Passing `--manifest FILE` processes the shows listed in FILE, which is
+    JSON, or TOML if its name ends with `.toml`. It holds a list of shows,
+    either at the top level or under a `shows` key. Each show is a table with
+    the `source` directory and any long options named with `_` or `-`, such
+    as `title`, `input_fmt`, `season_split` or `zero_pad`. Options given on
+    the command line apply to every show unless overridden. Like in library
+    mode, the title defaults to the name of the source directory and outputs
+    are created inside it. Relative paths are relative to FILE.
+
+        [[shows]]
+        source = "anime/Code Geass"
+        input_fmt = ["[a-s]_code_geass_r2_-_%n%a.%f"]
+        season_split = [25, 25]
+
+    All shows run one after another in a single process, so each distinct
+    input format is only compiled once and shows sharing a directory share a
+    single listing of it.
 ''',
     add_help=False,
     formatter_class=argparse.RawDescriptionHelpFormatter
@@ -92,13 +152,25 @@ argparser.add_argument(
 )
 argparser.add_argument(
     '--output-type',
-    choices=['symlink', 'hardlink', 'copy', 'move'],
+    choices=OUTPUT_TYPES,
     default='symlink',
     help='Specifies the file type used for the output. Both `symlink` and \
           `hardlink` take negligibly additional disk space whereas `copy` \
-          makes an extra copy of the file. Finally, `move` simply moves \
+          makes an extra copy of the file. On filesystems supporting it, \
+          such as btrfs or XFS, `reflink` creates an independent copy which \
+          shares its data with the original until either is modified, and \
+          otherwise falls back to `copy`. Finally, `move` simply moves \
           the existing file from one location to another.'
 )
+argparser.add_argument(
+    '--io-jobs',
+    metavar='N',
+    help='The number of files created concurrently. Raising it helps on \
+          network mounts, where each operation waits for a round trip. \
+          Files which cannot be created are reported without stopping the \
+          others. The default is 4 for the `copy` and `reflink` output \
+          types and 1 otherwise.'
+)
 argparser.add_argument(
     '--first',
     metavar='N',
@@ -111,8 +183,8 @@ argparser.add_argument(
 )
 argparser.add_argument(
     '-t', '--title',
-    required=True,
-    help='The title to begin each file name with.'
+    help='The title to begin each file name with. Required unless using \
+          `--library` or `--manifest`.'
 )
 argparser.add_argument(
     '-s', '--season',
@@ -138,6 +210,14 @@ argparser.add_argument(
     metavar='N',
     help='Start renumbering files beginning at N instead of 1'
 )
+argparser.add_argument(
+    '--season-split',
+    metavar='N,N,...',
+    help='Split the files into consecutive seasons of the given lengths and \
+          number each season from the beginning, such as `13,13,26`. The \
+          first season is 1 unless `--season` is specified. Implies \
+          `--renumber`.'
+)
 argparser.add_argument(
     '--strip-season',
     action='store_true',
@@ -154,6 +234,9 @@ argparser.add_argument(
 class AUTO_ZERO_PAD:
     def __int__(self):
         return 1
+
+    def __repr__(self):
+        return 'AUTO_ZERO_PAD'
 argparser.add_argument(
     '--zero-pad',
     nargs='?',
@@ -170,21 +253,115 @@ argparser.add_argument(
           passed but any destination file already exists, an error will \
           occur before creating any output files.'
 )
+argparser.add_argument(
+    '--sync',
+    action='store_true',
+    help='Only create the outputs which are missing or wrong. Existing \
+          outputs which already are what would be created, such as symbolic \
+          links to the right source, are left alone and others are replaced. \
+          When the destination is the source directory, earlier outputs found \
+          there are not taken for sources. Cannot be used with the `move` \
+          output type.'
+)
+argparser.add_argument(
+    '--prune',
+    action='store_true',
+    help='With `--sync`, also remove the symbolic links in the destination \
+          which point to files of the source directory that are no longer \
+          planned, such as deleted files. Links to planned files are kept \
+          even under another name, so shows sharing a destination keep each \
+          other\'s links.'
+)
 argparser.add_argument(
     '--resolve-overlaps',
-    choices=['error', 'newest', 'oldest', 'any'],
+    choices=['error', 'newest', 'oldest', 'any', 'identical'],
     default = 'error',
     help='The method for resolving conflicts when multiple source files \
           generate the same output file. The `newest` and `oldest` choices \
           will use the source files\' modified timestamp (resolving symbolic  \
-          links). Use the `any` choice if you don\'t care which file is chosen.'
+          links). Use the `any` choice if you don\'t care which file is chosen. \
+          The `identical` choice keeps the oldest file if all of them have the \
+          same contents and fails otherwise. Their contents are compared by \
+          size, then by hashing samples and only then by hashing them fully. \
+          With `--index`, the hashes are remembered across runs.'
 )
 argparser.add_argument(
     '--input-fmt',
-    default='%b%a%n%a.%f',
+    action='append',
     metavar='FMT',
     help='Specifies how the input file name should be parsed. See the INPUT \
-          FORMAT section below for details. The default is "%%b%%a%%n%%a.%%f"'
+          FORMAT section below for details. The default is "%%b%%a%%n%%a.%%f". \
+          May be given several times for directories mixing naming schemes, \
+          in which case the first format matching a file name is used.'
+)
+argparser.add_argument(
+    '--library',
+    metavar='DIR',
+    help='Recursively process every leaf directory below DIR as a separate \
+          show titled after the directory name. See the LIBRARY MODE section \
+          below for details.'
+)
+argparser.add_argument(
+    '--manifest',
+    metavar='FILE',
+    help='Process the shows listed in a JSON or TOML file, each with its own \
+          source directory and options. See the MANIFEST MODE section below \
+          for details.'
+)
+argparser.add_argument(
+    '-j', '--jobs',
+    metavar='N',
+    help='The number of worker processes used to process shows in parallel \
+          with `--library`. Defaults to the number of processors.'
+)
+argparser.add_argument(
+    '--index',
+    action='store_true',
+    help='Remember which files were parsed and which outputs they produced \
+          in a `.ep_rename.sqlite` file inside the destination directory. \
+          Later runs skip the directory entirely if nothing changed, and \
+          otherwise only parse and create outputs for new files.'
+)
+argparser.add_argument(
+    '--watch',
+    action='store_true',
+    help='After processing the current files, keep running and create \
+          outputs for new files as soon as they finish being written to the \
+          directory. Cannot be combined with options whose results depend on \
+          the full set of files, such as `--renumber` or `--first`.'
+)
+argparser.add_argument(
+    '--plan-out',
+    metavar='FILE',
+    help='Instead of modifying the filesystem, write the operations which \
+          would be performed to FILE, one per line, so they can be reviewed \
+          and executed later with `--apply`.'
+)
+argparser.add_argument(
+    '--apply',
+    metavar='FILE',
+    help='Execute the operations of a plan written by `--plan-out` without \
+          scanning or parsing any files. Progress is journaled to \
+          FILE.journal so an interrupted apply resumes when run again.'
+)
+argparser.add_argument(
+    '--stats',
+    nargs='?',
+    choices=['text', 'json'],
+    const='text',
+    metavar='FORMAT',
+    help='After running, print the wall time and number of calls of each \
+          phase, the filesystem calls made and the bytes copied or moved to \
+          standard output. FORMAT is `text` (the default) or `json` for a \
+          single line JSON document per show.'
+)
+argparser.add_argument(
+    '--log-format',
+    choices=['text', 'json'],
+    default='text',
+    help='Write messages to standard error as `text` (the default) or as \
+          `json`, one JSON object per line with the name of the event, its \
+          level and fields such as the files involved.'
 )
 argparser.add_argument(
     '--dry',
@@ -199,16 +376,46 @@ argparser.add_argument(
 )
 
 
-def sort_inputs_by_time(inputs):
-    inputs.sort(key=lambda p: p['file'].stat().st_mtime)
+class EpRenameError(Exception):
+    """Raised when the files cannot be renamed as requested. The message
+    explains why, and may span several lines."""
+
+def sort_inputs_by_time(inputs, snapshot):
+    inputs.sort(key=lambda p: snapshot.mtime(p.file))
 
 def sort_inputs_by_num(inputs):
-    inputs.sort(key=lambda p: p['number'])
+    inputs.sort(key=lambda p: p.number.key)
+
+def select_inputs_by_num(inputs, stop=None):
+    """Returns the first `stop` of `inputs` in the order of their numbers, or
+    all of them if `stop` is None, along with the number of `inputs`, which
+    may be any iterable. Ties keep their order like in `sort_inputs_by_num`.
+    Given `stop`, only that many inputs are held at once in a heap, so taking
+    a few of many files takes O(n log stop) time and O(stop) memory."""
+    total = 0
+
+    def counted():
+        nonlocal total
+        for input in inputs:
+            total += 1
+            yield input
+
+    if stop is None:
+        selected = list(counted())
+        sort_inputs_by_num(selected)
+    else:
+        selected = heapq.nsmallest(stop, counted(), key=lambda p: p.number.key)
+    return selected, total
 
 class Number:
+    __slots__ = ('season', 'episode', 'key')
+
     def __init__(self, season, episode):
         self.season = season
         self.episode = episode
+        # handle sorting ep 101 after episode 2 by converting to numbers once
+        # use negative infinity so episodes without seasons can still be sorted
+        self.key = (int(season) if season else float('-inf'), int(episode))
 
     def __str__(self):
         if self.season:
@@ -219,335 +426,2168 @@ class Number:
     def __eq__(self, other):
         return self.season == other.season and self.episode == other.episode
 
-    def __key(self):
-        return (int(self.season) if self.season else float('-inf'), int(self.episode))
-
     def __lt__(self, other):
-        # handle sorting ep 101 after episode 2 by converting to numbers
-        # use negative infinity so episodes without seasons can still be sorted
-        return self.__key() < other.__key()
+        return self.key < other.key
+
+    def replace(self, season, episode):
+        """Returns a Number with the given fields, reusing this one if they are
+        unchanged."""
+        if season == self.season and episode == self.episode:
+            return self
+        return Number(season, episode)
+
+class Input:
+    """A source file along with the fields extracted from its name."""
+    __slots__ = ('file', 'fmt', 'number', 'parsed', 'suffix', 'dest', 'stamp')
+
+    def __init__(self, file):
+        self.file = file
+        # the index of the `--input-fmt` which matched the name
+        self.fmt = None
+        self.number = None
+        # the number as extracted from the name, before any renumbering
+        self.parsed = None
+        self.suffix = None
+        self.dest = None
+        # (inode, size, mtime) of the file when using `--index`
+        self.stamp = None
+
+SEASONED_NUMBER = re.compile(r'[sS]([0-9]+)[eE]([0-9]+)')
 
 def extract_general_number(input, s):
-    seasoned = re.fullmatch(r'[sS]([0-9]+)[eE]([0-9]+)', s)
+    seasoned = SEASONED_NUMBER.fullmatch(s)
     if seasoned:
         season, episode = seasoned.group(1, 2)
     else:
         season = None
         episode = s
-    input['number'] = Number(season, episode)
+    input.number = Number(season, episode)
 
 def extract_suffix(input, s):
-    input['suffix'] = s
+    input.suffix = s
+
+# from linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning the filesystem or kernel can't perform a particular kind of
+# copy, so the next method should be tried
+COPY_UNSUPPORTED = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EOPNOTSUPP,
+    errno.EBADF, errno.ETXTBSY,
+}
+
+def clone_data(fsrc, fdst):
+    """Makes `fdst` share the data of `fsrc` without copying it. Returns
+    whether the filesystem supported doing so."""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError as e:
+        if e.errno not in COPY_UNSUPPORTED:
+            raise
+        return False
+
+def copy_data(fsrc, fdst, size):
+    """Copies `size` bytes from `fsrc` to `fdst` within the kernel if possible,
+    using `copy_file_range`, then `sendfile`, then plain reads and writes.
+    Some filesystems copy nothing instead of failing, so a method which
+    copies nothing of a non-empty file falls back to the next one."""
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    offset = 0
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                n = os.copy_file_range(infd, outfd, size - offset)
+                if n == 0:
+                    break
+                offset += n
+            if offset or not size:
+                return
+        except OSError as e:
+            if e.errno not in COPY_UNSUPPORTED:
+                raise
+
+    if hasattr(os, 'sendfile'):
+        try:
+            while offset < size:
+                n = os.sendfile(outfd, infd, offset, size - offset)
+                if n == 0:
+                    break
+                offset += n
+            if offset or not size:
+                return
+        except OSError as e:
+            if e.errno not in COPY_UNSUPPORTED:
+                raise
+
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    shutil.copyfileobj(fsrc, fdst)
+
+# errors meaning extended attributes can't be read or written
+XATTR_UNSUPPORTED = {errno.ENOTSUP, errno.ENODATA, errno.EINVAL, errno.EPERM, errno.EACCES}
+
+def copy_metadata(fsrc, fdst, st):
+    """Like `shutil.copystat` for the open file descriptors `fsrc`, whose stat
+    result is `st`, and `fdst`."""
+    if hasattr(os, 'listxattr'):
+        try:
+            for name in os.listxattr(fsrc):
+                os.setxattr(fdst, name, os.getxattr(fsrc, name))
+        except OSError as e:
+            if e.errno not in XATTR_UNSUPPORTED:
+                raise
+    os.chmod(fdst, stat.S_IMODE(st.st_mode))
+    os.utime(fdst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+def copy_file(src, dst, reflink=False, src_dir_fd=None, dst_dir_fd=None):
+    """Copies `src` to `dst` along with its metadata like `shutil.copy2`. With
+    `reflink`, the data is cloned instead when the filesystem allows it. The
+    paths are relative to the directory descriptors if they are given.
+    Returns a pair of the number of bytes copied and cloned."""
+    src_fd = os.open(src, os.O_RDONLY, dir_fd=src_dir_fd)
+    with open(src_fd, 'rb') as fsrc:
+        st = os.fstat(fsrc.fileno())
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666,
+                         dir_fd=dst_dir_fd)
+        with open(dst_fd, 'wb') as fdst:
+            cloned = reflink and clone_data(fsrc, fdst)
+            if not cloned:
+                copy_data(fsrc, fdst, st.st_size)
+            fdst.flush()
+            copy_metadata(fsrc.fileno(), fdst.fileno(), st)
+    return (0, st.st_size) if cloned else (st.st_size, 0)
+
+def move_file(src, dst, src_dir_fd=None, dst_dir_fd=None):
+    """Like `shutil.move` for files, with paths relative to the directory
+    descriptors if they are given."""
+    try:
+        os.rename(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    # on another filesystem
+    if stat.S_ISLNK(os.stat(src, dir_fd=src_dir_fd, follow_symlinks=False).st_mode):
+        os.symlink(os.readlink(src, dir_fd=src_dir_fd), dst, dir_fd=dst_dir_fd)
+    else:
+        copy_file(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+    os.unlink(src, dir_fd=src_dir_fd)
+
+# `--resolve-overlaps identical` first compares this many evenly spread chunks
+# of this size, which covers small files entirely
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 16
+
+def hash_file(path, size, sample, dir_fd=None):
+    """Hashes the contents of the file at `path` of the given `size`, or only
+    the chunks at `SAMPLE_COUNT` evenly spread offsets if `sample` is given and
+    the file is larger than them. `path` is relative to the directory
+    descriptor `dir_fd` if it is given."""
+    h = hashlib.blake2b()
+    fd = os.open(path, os.O_RDONLY, dir_fd=dir_fd)
+    with open(fd, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if sample and size > SAMPLE_SIZE * SAMPLE_COUNT:
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_RANDOM)
+            step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+            for i in range(SAMPLE_COUNT):
+                h.update(m[i * step:i * step + SAMPLE_SIZE])
+        else:
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            h.update(m)
+    return h.hexdigest()
+
+def format_size(n):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if n < 1024:
+            break
+        n /= 1024
+    else:
+        unit = 'TiB'
+    return '{:.1f} {}'.format(n, unit) if unit != 'B' else '{:.0f} B'.format(n)
+
+# stands in for the `os.DirEntry` of a regular file named by the caller
+LISTED = object()
+
+def parse_input_fmt(fmt):
+    """Splits a `--input-fmt` string into a list of tokens, which are either
+    pattern group letters such as 'n' or strings of literal characters."""
+    tokens = []
+    literal = ''
+    i = 0
+    while i < len(fmt):
+        if fmt[i] != '%':
+            literal += fmt[i]
+            i += 1
+            continue
+        if i + 1 == len(fmt):
+            raise EpRenameError('`--input-fmt` cannot end with a lone `%`')
+        c = fmt[i + 1]
+        i += 2
+        if c == '%':
+            literal += c
+            continue
+        if c not in 'aAbnf':
+            raise EpRenameError(('unrecognized pattern group `%{}` used '
+                                 'in `--input-fmt`').format(c))
+        if c == 'f' and i < len(fmt):
+            raise EpRenameError('cannot include anything in `--input-fmt` '
+                                'after the `%f` pattern group')
+        if literal:
+            tokens.append(literal)
+            literal = ''
+        tokens.append(c)
+    if literal:
+        tokens.append(literal)
+    if 'n' not in tokens:
+        raise EpRenameError('must specify a way to infer episode numbers '
+                            'when using `--input-fmt`')
+    return tokens
+
+def escape_literal(s):
+    return ''.join('\\' + c if c in '.^$*+?{}\\[]|()' else c for c in s)
+
+# atomic groups are only supported by `re` since Python 3.11
+ATOMIC_GROUPS = sys.version_info >= (3, 11)
+
+def number_is_final(tokens, i):
+    """Returns whether the digits matched by the `%n` at `tokens[i]` can never
+    be shortened to let the rest of the format match, because the next token
+    which must consume characters cannot start with a digit."""
+    for token in tokens[i + 1:]:
+        if token in ('a', 'b'):
+            # `%a` may be empty and brackets may be absent, so the token
+            # after them decides
+            continue
+        if token in ('A', 'n', 'f'):
+            # `%A` needs a character, which may be a digit given up by `%n`
+            return False
+        return not token[0].isdigit()
+    return True
+
+def compile_input_fmt(fmt, batch=False):
+    """Compiles a `--input-fmt` string into a regex and the list of methods
+    which extract fields from its groups, in order. With `batch`, nothing
+    matches across newlines, so the regex can scan many names joined by them.
+
+    Naively translated formats backtrack heavily on long names which don't
+    match, so equivalent constructs are emitted where they avoid it: runs of
+    `%a`/`%A` become a single wildcard, `%b` brackets end at their first `]`,
+    the digits of `%n` are matched atomically when shortening them could never
+    help, and names lacking the literal text before `%f` are rejected up
+    front."""
+    tokens = parse_input_fmt(fmt)
+    newline = '\\n' if batch else ''
+    regex = ''
+    methods = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ('a', 'A'):
+            least = 0
+            while i < len(tokens) and tokens[i] in ('a', 'A'):
+                least += tokens[i] == 'A'
+                i += 1
+            regex += {0: '.*?', 1: '.+?'}.get(least, '.{%d,}?' % least)
+            continue
+        elif token == 'b':
+            regex += r'(?:\[[^\]%s]*\])*' % newline
+        elif token == 'n':
+            if ATOMIC_GROUPS and number_is_final(tokens, i):
+                regex += '((?>[sS][0-9]+[eE][0-9]+|[0-9]+))'
+            else:
+                regex += '((?:[sS][0-9]+[eE][0-9]+)|(?:[0-9]+))'
+            methods.append(extract_general_number)
+        elif token == 'f':
+            regex += r'([^\.%s]+)$' % newline
+            methods.append(extract_suffix)
+            if i > 0 and tokens[i - 1] not in ('a', 'A', 'b', 'n'):
+                regex = '(?=.*{}[^\\.{}]+$)'.format(escape_literal(tokens[i - 1]),
+                                                newline) + regex
+        else:
+            regex += escape_literal(token)
+        i += 1
+    return re.compile(regex), methods
+
+@functools.lru_cache(maxsize=None)
+def compile_input_fmts(fmts, batch=False):
+    """Combines several `--input-fmt` strings into a single regex, so each
+    name is matched once against all of them. Each format becomes a capturing
+    group named after its index in `fmts`, and earlier formats take precedence.
+    With `batch`, the regex matches every whole line of a newline-joined
+    buffer, so scanning never restarts inside a line, and lines which match no
+    format have no `lastindex`.
+
+    `fmts` must be a tuple, as the results are cached for programs sharing
+    the same formats.
+
+    Returns the regex and a dict from the index of each such group, which is
+    the `lastindex` of a match, to the index of the format and the methods
+    extracting fields from the groups following it."""
+    alternatives = []
+    groups = {}
+    index = 1
+    for i, fmt in enumerate(fmts):
+        regex, methods = compile_input_fmt(fmt, batch)
+        alternatives.append('(?P<fmt{}>{})'.format(i, regex.pattern))
+        groups[index] = (i, methods)
+        index += 1 + len(methods)
+    if batch:
+        alternatives.append('.*')
+        return re.compile('^(?:{})$'.format('|'.join(alternatives)), re.MULTILINE), groups
+    return re.compile('|'.join(alternatives)), groups
+
+# whether files can be accessed relative to an open directory, so the kernel
+# doesn't resolve the path of the directory again for each of them
+DIR_FD = ({os.open, os.stat, os.symlink, os.link, os.unlink, os.rename, os.readlink}
+          <= os.supports_dir_fd and {os.stat, os.listdir} <= os.supports_fd)
+
+class Listing:
+    """The entries of a single directory, read once with `os.scandir` unless
+    they are given. Entries may be `os.DirEntry` objects or the names of
+    regular files. Where supported, the directory is opened once and files in
+    it are accessed relative to it, which also keeps them in the same
+    directory if it is renamed meanwhile. It is listed by path all the same,
+    as the entries outlive the descriptor and use it for their own stats."""
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.syscalls = 0
+        self._fd = None
+        if entries is None:
+            with os.scandir(path) as entries:
+                self.entries = {e.name: e for e in entries}
+            self.syscalls += 1
+        else:
+            self.entries = {}
+            for e in entries:
+                if isinstance(e, str):
+                    self.entries[e] = LISTED
+                else:
+                    self.entries[e.name] = e
+        self.stats = {}
+        self.resolved = None
+        self.lookups = 0
+
+    @property
+    def fd(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            self.syscalls += 1
+            self._close = weakref.finalize(self, os.close, self._fd)
+        return self._fd
+
+    def close(self):
+        """Closes the directory if it was opened. It is opened again if
+        needed."""
+        if self._fd is not None:
+            self._close()
+            self._fd = None
+
+    def at(self, name):
+        """Returns the arguments naming the file `name` to functions taking a
+        path and a `dir_fd`."""
+        if DIR_FD:
+            return name, self.fd
+        return os.path.join(self.path, name), None
+
+    def stat(self, name):
+        if name not in self.stats:
+            self.syscalls += 1
+            path, fd = self.at(name)
+            self.stats[name] = os.stat(path, dir_fd=fd)
+        return self.stats[name]
+
+    def resolve(self, name):
+        if self.resolved is None:
+            self.syscalls += 1
+            self.resolved = Path(self.path).resolve()
+        entry = self.entries.get(name)
+        if entry is None or entry is LISTED or entry.is_symlink():
+            self.syscalls += 1
+            path, fd = self.at(name)
+            try:
+                target = os.readlink(path, dir_fd=fd)
+            except OSError:
+                # not a symbolic link, or gone
+                return self.resolved / name
+            # the target may be a symbolic link in turn
+            return (self.resolved / target).resolve()
+        return self.resolved / name
+
+    def listdir(self):
+        """Lists the directory again, without keeping the entries."""
+        self.syscalls += 1
+        return os.listdir(self.fd if DIR_FD else self.path)
+
+    def mtime(self):
+        """Returns the current modification time of the directory itself."""
+        self.syscalls += 1
+        return os.stat(self.fd if DIR_FD else self.path).st_mtime_ns
+
+class Snapshot:
+    """Answers existence, type and modification time questions about files
+    from directory listings taken once, instead of asking the filesystem for
+    each file. Files created or removed by this program are recorded so the
+    snapshot stays accurate while applying."""
+    def __init__(self):
+        self.listings = {}
+        # listings by directory as given, to skip normalizing it again
+        self.aliases = {}
+
+    def listing(self, directory):
+        key = os.path.abspath(directory)
+        if key not in self.listings:
+            self.listings[key] = Listing(key)
+        listing = self.listings[key]
+        listing.lookups += 1
+        return listing
+
+    def locate(self, path):
+        """Returns the listing of the directory holding `path` and the name of
+        `path` in it. Cheaper than `listing(path.parent)` for many files."""
+        directory, name = os.path.split(path)
+        listing = self.aliases.get(directory)
+        if listing is None:
+            listing = self.aliases[directory] = self.listing(directory)
+        else:
+            listing.lookups += 1
+        return listing, name
+
+    def preload(self, directory, entries):
+        """Uses the given entries of `directory` instead of listing it."""
+        key = os.path.abspath(directory)
+        self.listings[key] = Listing(key, entries)
+        self.aliases.clear()
+
+    def files(self, directory):
+        """Returns the names of the regular files in `directory`, following
+        symbolic links."""
+        listing = self.listing(directory)
+        names = []
+        for name, entry in listing.entries.items():
+            if entry is LISTED:
+                is_file = True
+            elif entry is None or entry.is_symlink():
+                try:
+                    is_file = stat.S_ISREG(listing.stat(name).st_mode)
+                except OSError:
+                    # broken symbolic link
+                    is_file = False
+            else:
+                is_file = entry.is_file()
+            if is_file:
+                names.append(name)
+        listing.lookups += len(listing.entries) - 1
+        return names
+
+    def exists(self, path):
+        """Like `os.path.lexists`, so broken symbolic links also exist."""
+        listing, name = self.locate(path)
+        return name in listing.entries
+
+    def stat(self, path):
+        listing, name = self.locate(path)
+        return listing.stat(name)
+
+    def at(self, path):
+        """Like `Listing.at` for the directory holding `path`."""
+        listing, name = self.locate(path)
+        return listing.at(name)
+
+    def lexists(self, path):
+        """Like `exists`, but asks the filesystem."""
+        name, fd = self.at(path)
+        try:
+            os.stat(name, dir_fd=fd, follow_symlinks=False)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def readlink(self, path):
+        name, fd = self.at(path)
+        return os.readlink(name, dir_fd=fd)
+
+    def unlink(self, path):
+        name, fd = self.at(path)
+        os.unlink(name, dir_fd=fd)
+        self.removed(path)
+
+    def is_symlink(self, path):
+        listing, name = self.locate(path)
+        entry = listing.entries.get(name)
+        if entry is LISTED:
+            return False
+        if entry is None:
+            listing.syscalls += 1
+            name, fd = listing.at(name)
+            try:
+                st = os.stat(name, dir_fd=fd, follow_symlinks=False)
+            except OSError:
+                return False
+            return stat.S_ISLNK(st.st_mode)
+        return entry.is_symlink()
+
+    def mtime(self, path):
+        return self.stat(path).st_mtime
+
+    def resolve(self, path):
+        listing, name = self.locate(path)
+        return listing.resolve(name)
+
+    def created(self, path):
+        listing, name = self.locate(path)
+        listing.entries[name] = None
+        listing.stats.pop(name, None)
+
+    def removed(self, path):
+        listing, name = self.locate(path)
+        listing.entries.pop(name, None)
+        listing.stats.pop(name, None)
+
+    def close(self):
+        """Closes the directories opened so far, so a snapshot shared by many
+        shows doesn't keep one open for each of them."""
+        for listing in self.listings.values():
+            listing.close()
+
+    def counts(self):
+        """Returns the number of lookups answered and syscalls performed."""
+        lookups = sum(l.lookups for l in self.listings.values())
+        syscalls = sum(l.syscalls for l in self.listings.values())
+        return lookups, syscalls
+
+class Stats:
+    """Wall time and number of calls of each phase of a run, along with other
+    counters, for `--stats`. Filesystem calls are counted through the audit
+    events Python raises for them, except for stats, which are counted by the
+    snapshot."""
+    # audit events of filesystem calls
+    EVENTS = {
+        'open', 'os.scandir', 'os.listdir', 'os.symlink', 'os.link', 'os.remove',
+        'os.rename', 'os.mkdir', 'os.truncate', 'os.utime', 'os.chmod', 'os.setxattr',
+        'mmap.__new__',
+    }
+
+    # the instance counting audit events, as the hook cannot be removed
+    active = None
+    hooked = False
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.syscalls = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            calls, seconds = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (calls + 1, seconds + time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def auditing(self):
+        """Counts the filesystem calls made by any thread meanwhile."""
+        if not Stats.hooked:
+            sys.addaudithook(Stats.audit)
+            Stats.hooked = True
+        Stats.active = self
+        try:
+            yield
+        finally:
+            Stats.active = None
+
+    @staticmethod
+    def audit(event, args):
+        stats = Stats.active
+        if stats is not None and event in Stats.EVENTS:
+            with stats.lock:
+                stats.syscalls[event] = stats.syscalls.get(event, 0) + 1
+
+    def report(self, source, snapshot_counts, format):
+        lookups, syscalls = snapshot_counts
+        if format == 'json':
+            return json.dumps({
+                'source': os.path.abspath(source),
+                'phases': {name: {'calls': calls, 'seconds': round(seconds, 6)}
+                           for name, (calls, seconds) in self.phases.items()},
+                'syscalls': self.syscalls,
+                'snapshot': {'lookups': lookups, 'syscalls': syscalls},
+                'counters': self.counters,
+            }, sort_keys=True)
+        lines = ['stats for {!r}:'.format(str(source)),
+                 '  {:<12} {:>6} {:>10}'.format('phase', 'calls', 'seconds')]
+        for name, (calls, seconds) in self.phases.items():
+            lines.append('  {:<12} {:>6} {:>10.6f}'.format(name, calls, seconds))
+        lines.append('  syscalls: ' + (', '.join('{}={}'.format(name, n) for name, n
+                                                in sorted(self.syscalls.items()))
+                                      or 'none'))
+        lines.append('  snapshot: answered {} lookups with {} listings, stats and '
+                     'resolves'.format(lookups, syscalls))
+        for name, n in sorted(self.counters.items()):
+            if name.startswith('bytes_'):
+                n = format_size(n)
+            lines.append('  {}: {}'.format(name.replace('_', ' '), n))
+        return '\n'.join(lines)
+
+class Inotify:
+    """Minimal binding to the Linux inotify API for watching a directory."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_CLOEXEC = 0o2000000
+
+    # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, path, mask):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported on this system')
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            e = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(e, os.strerror(e), str(path))
+
+    def events(self):
+        """Yields the names of files as events arrive, blocking in between.
+        Yields None if the kernel dropped events."""
+        while True:
+            buf = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, length = self.EVENT.unpack_from(buf, offset)
+                offset += self.EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    yield None
+                elif mask & self.IN_IGNORED:
+                    # the directory itself went away
+                    return
+                else:
+                    yield os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+PLAN_HEADER = '# ep_rename plan v1'
+
+class Journal:
+    """Records which operations of a plan were started and finished, one per
+    line, so an interrupted apply can resume. The file is only created once
+    the first operation starts."""
+    def __init__(self, path):
+        self.path = path
+        self.started = set()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    state, dest = json.loads(line)
+                    (self.done if state == 'done' else self.started).add(dest)
+        self.file = None
+
+    def write(self, state, dest):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(json.dumps([state, str(dest)], ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def start(self, dest):
+        self.write('start', dest)
+
+    def finish(self, dest):
+        self.write('done', dest)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+class Index:
+    """Remembers across runs what was extracted from each source file and which
+    output it produced, along with the state of each directory when it was
+    last processed. Everything is recorded per job, a source directory along
+    with the options it was processed with, so several jobs reading the same
+    directory into the same destination don't replace each other's state."""
+    NAME = '.ep_rename.sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS directories (
+            source TEXT NOT NULL,
+            job TEXT NOT NULL,
+            source_mtime INTEGER NOT NULL,
+            destination_mtime INTEGER NOT NULL,
+            PRIMARY KEY (source, job)
+        );
+        CREATE TABLE IF NOT EXISTS digests (
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            sample INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (device, inode, sample)
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            source TEXT NOT NULL,
+            job TEXT NOT NULL,
+            name TEXT NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            season TEXT,
+            episode TEXT NOT NULL,
+            suffix TEXT,
+            destination TEXT NOT NULL,
+            PRIMARY KEY (source, job, name)
+        );
+    """
+
+    def __init__(self, directory, create=True):
+        """Opens the index in `directory`, creating it if needed. Unless
+        `create`, an existing index is opened for reading only."""
+        path = os.path.join(directory, self.NAME)
+        self.writable = create
+        if not create:
+            uri = 'file:{}?mode=ro'.format(urllib.parse.quote(os.path.abspath(path)))
+            self.db = sqlite3.connect(uri, uri=True)
+            return
+        self.db = sqlite3.connect(path)
+        # keep the journal file around so committing doesn't change the
+        # modification time of the directory holding the index
+        self.db.execute('PRAGMA journal_mode=PERSIST')
+        self.db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def job(options):
+        """Returns the key of the job processing a directory with the given
+        serialized options."""
+        return hashlib.blake2b(options.encode(), digest_size=16).hexdigest()
+
+    def directory(self, source, job):
+        return self.db.execute(
+            'SELECT source_mtime, destination_mtime FROM directories '
+            'WHERE source = ? AND job = ?', (source, job)).fetchone()
+
+    def files(self, source, job):
+        rows = self.db.execute(
+            'SELECT name, inode, size, mtime, season, episode, suffix, destination '
+            'FROM files WHERE source = ? AND job = ?', (source, job))
+        return {row[0]: row[1:] for row in rows}
+
+    def outputs(self, source):
+        """Returns the outputs created for `source` by any job."""
+        rows = self.db.execute('SELECT destination FROM files WHERE source = ?',
+                               (source,))
+        return {row[0] for row in rows}
+
+    def digest(self, device, inode, sample, size, mtime):
+        row = self.db.execute(
+            'SELECT digest FROM digests WHERE device = ? AND inode = ? AND sample = ? '
+            'AND size = ? AND mtime = ?', (device, inode, sample, size, mtime)).fetchone()
+        return row and row[0]
+
+    def record_digest(self, device, inode, sample, size, mtime, digest):
+        if not self.writable:
+            return
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)',
+                            (device, inode, sample, size, mtime, digest))
+
+    def record(self, source, job, source_mtime, destination_mtime, files):
+        """Records the state of `source` and the given files for `job`."""
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((source, job) + row for row in files))
+            self.db.execute(
+                'INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)',
+                (source, job, source_mtime, destination_mtime))
+
+def plain(value):
+    """Converts paths, also inside lists, to strings for messages."""
+    if isinstance(value, PurePath):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    return value
+
+class Logger:
+    """Writes messages to standard error as text or as JSON lines. Each
+    message is an event with named fields which are only turned into text
+    once it is written, so callers don't pay for messages which aren't
+    shown. JSON lines hold the name of the event, its level and the fields
+    instead of the text. Output is buffered until `flush` or until
+    `BUFFER_SIZE` characters are pending."""
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, format='text', stream=None):
+        self.format = format
+        self.stream = stream
+        self.pending = []
+        self.size = 0
+        # `json.dumps` would create an encoder for every message
+        self.encode = json.JSONEncoder(default=str).encode
+
+    def write(self, level, event, msg, fields):
+        for name, value in fields.items():
+            if isinstance(value, (PurePath, list, tuple)):
+                fields[name] = plain(value)
+        if self.format == 'json':
+            record = {'event': event, 'level': level}
+            record.update(fields)
+            text = self.encode(record)
+        else:
+            text = msg.format(**fields)
+        self.pending.append(text + '\n')
+        self.size += len(text) + 1
+        if self.size >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            stream = self.stream or sys.stderr
+            stream.write(''.join(self.pending))
+            stream.flush()
+            self.pending = []
+            self.size = 0
+
+CHOSE_OVERLAP = 'choosing {chosen!r} for {dest!r} in favor of {ignored!r}'
 
 class Program:
-    def __init__(self, args):
+    def __init__(self, args, source=Path('.'), snapshot=None):
         self.args = args
+        self.source = source
+        self.snapshot = snapshot or Snapshot()
+        # counts of a snapshot shared with earlier programs
+        self.snapshot_start = self.snapshot.counts()
+        self.logger = Logger(args.log_format)
+        self.index = None
+        self.index_files = {}
+        # the key of this run's job in the index
+        self.job = None
+        self.stats = Stats()
+        # digests of source contents for `--resolve-overlaps identical`, keyed
+        # by device, inode, whether sampled, size and modification time
+        self.digests = {}
+        self.scanned_mtime = None
+        self.zero_pad_width = None
+        # destinations of the current plan, kept for `--watch`
+        self.planned = {}
+        # whether the sources of the inputs are already resolved, as they are
+        # when applying a plan file
+        self.sources_resolved = False
+        # symbolic links to remove for `--prune`
+        self.stale = []
         self.input_fmt_regex = None
-        self.input_fmt_methods = None
+        self.input_fmt_batch_regex = None
+        self.input_fmt_groups = None
         self.construct_input_fmt()
 
-    def log(self, level, msg):
+    def log(self, level, event, msg, **fields):
+        """Logs the event `event` if `level` is enabled by `--verbose`. `msg`
+        is a format string for the `fields`; level 0 is for warnings and
+        errors which are shown by default."""
         if level <= self.args.verbose:
-            print(msg, file=sys.stderr)
+            self.logger.write(level, event, msg, fields)
 
     def construct_input_fmt(self):
-        fmt = self.args.input_fmt
-        regex = r''
-        methods = []
-        specified_number = False
-        while len(fmt) > 0:
-            if fmt[0] == '%':
-                c = fmt[1]
-                fmt = fmt[2:]
-                if c == 'a':
-                    regex += r'.*?'
-                elif c == 'A':
-                    regex += r'.+?'
-                elif c == 'b':
-                    regex += r'(?:\[.*?\])*'
-                elif c == 'n':
-                    regex += '((?:[sS][0-9]+[eE][0-9]+)|(?:[0-9]+))'
-                    methods.append(extract_general_number)
-                    specified_number = True
-                elif c == 'f':
-                    regex += r'([^\.]+)$'
-                    methods.append(extract_suffix)
-                    if len(fmt) > 0:
-                        self.log(0, 'cannot include anything in `--input-fmt` \
-                                     after the `%f` pattern group')
-                        sys.exit(1)
-                else:
-                    self.log(0, ('unrecognized pattern group `%{}` used in ' +
-                                 '`--input-fmt`').format(c))
-                    sys.exit(1)
-            else:
-                c = fmt[0]
-                fmt = fmt[1:]
-                if c in '.^$*+?{}\\[]|()':
-                    regex += '\\' + c
-                else:
-                    regex += c
-
-        if not specified_number:
-            self.log(0, 'must specify a way to infer episode numbers when using'
-                        + ' `--input-fmt`')
-            sys.exit(1)
-
-        self.log(2, 'input_fmt: regex=' + repr(regex))
-        self.log(2, 'input_fmt: methods=' + repr(methods))
+        regex, groups = compile_input_fmts(tuple(self.args.input_fmt))
+        if self.args.verbose >= 2:
+            self.log(2, 'input_fmt', 'input_fmt: regex={regex!r}', regex=regex.pattern)
+            self.log(2, 'input_fmt', 'input_fmt: methods={methods!r}',
+                     methods=[g[1] for g in groups.values()])
         self.input_fmt_regex = regex
-        self.input_fmt_methods = methods
+        self.input_fmt_batch_regex, _ = compile_input_fmts(tuple(self.args.input_fmt),
+                                                           batch=True)
+        self.input_fmt_groups = groups
 
     def extract_input(self, f):
-        input = {}
-        input['file'] = f
-        input['suffix'] = None
-
-        m = re.fullmatch(self.input_fmt_regex, f.name)
+        m = self.input_fmt_regex.fullmatch(f.name)
         if not m:
-            self.log(0, 'warning: skipping file ' + repr(str(f)))
+            self.log(0, 'skipped_file', 'warning: skipping file {file!r}', file=f)
             return None
-
-        groups = m.group(*[i + 1 for i in range(len(self.input_fmt_methods))])
-        for field, s in zip(self.input_fmt_methods, groups):
+        return self.extract_match(f, m)
+
+    def extract_inputs(self, names):
+        """Like `extract_input` for all the `names` in the source directory at
+        once, yielding the inputs as they are extracted. The names are joined
+        by newlines into a single buffer which is scanned in one pass, and
+        objects are only created for the names which match. Names containing
+        newlines are matched one by one."""
+        lines = [name for name in names if '\n' not in name]
+        matches = self.input_fmt_batch_regex.finditer('\n'.join(lines))
+        for name, m in zip(lines, matches):
+            if m.lastindex:
+                yield self.extract_match(self.source / name, m)
+            else:
+                self.log(0, 'skipped_file', 'warning: skipping file {file!r}', file=name)
+        if len(lines) < len(names):
+            for name in names:
+                if '\n' in name:
+                    input = self.extract_input(self.source / name)
+                    if input:
+                        yield input
+
+    def extract_match(self, f, m):
+        input = Input(f)
+        input.fmt, methods = self.input_fmt_groups[m.lastindex]
+        groups = m.groups()[m.lastindex:m.lastindex + len(methods)]
+        for field, s in zip(methods, groups):
             field(input, s)
-
-        season = input['number'].season
-        episode = input['number'].episode
-        suffix = input['suffix']
-        self.log(2,
-                 'extracted season={!r} episode={!r} suffix={!r} from file={!r}'
-                 .format(season, episode, suffix, str(f)))
-
+        input.parsed = input.number
+
+        if self.args.verbose >= 2:
+            self.log(2, 'extracted',
+                     'extracted season={season!r} episode={episode!r} suffix={suffix!r} '
+                     'from file={file!r} using input_fmt={input_fmt!r}',
+                     season=input.number.season, episode=input.number.episode,
+                     suffix=input.suffix, file=f, input_fmt=self.args.input_fmt[input.fmt])
         return input
 
-    def run(self):
-        files = [f for f in Path('.').iterdir() if f.is_file()]
-        inputs = map(self.extract_input, files)
-        inputs = list(filter(lambda x: x is not None, inputs))
-        sort_inputs_by_num(inputs)
-
-        if self.args.skip:
-            skip = int(self.args.skip)
-            if skip >= len(inputs):
-                self.log(0, 'warning: skipping all files')
-            inputs = inputs[skip:]
+    def extract_indexed_input(self, f):
+        """Like `extract_input`, but reuses the fields stored in the index if
+        the file is unchanged since they were extracted."""
+        st = self.snapshot.stat(f)
+        stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        row = self.index_files.get(f.name)
+        if row and row[:3] == stamp:
+            input = Input(f)
+            input.number = input.parsed = Number(row[3], row[4])
+            input.suffix = row[5]
+        else:
+            input = self.extract_input(f)
+        if input:
+            input.stamp = stamp
+        return input
 
-        if self.args.first:
-            first = int(self.args.first)
-            if first > len(inputs):
-                self.log(0, 'warning: there are only {} files but given --first={}'
-                            .format(len(inputs), first))
-            inputs = inputs[:first]
+    def open_index(self, create=True):
+        """Opens the index in the destination directory for `--index`. Unless
+        `create`, an existing index is only read and none is created, so
+        planning doesn't modify anything."""
+        if not self.args.index:
+            return
+        self.job = Index.job(self.options())
+        destination = self.args.destination or '.'
+        if create or os.path.exists(os.path.join(destination, Index.NAME)):
+            self.index = Index(destination, create)
+
+    def options(self):
+        """Serializes the arguments which affect the outputs of a run."""
+        ignored = {'verbose', 'dry', 'jobs', 'io_jobs', 'index', 'library', 'manifest',
+                   'stats', 'log_format'}
+        options = {k: v for k, v in vars(self.args).items() if k not in ignored}
+        # however the destination was spelled
+        options['destination'] = os.path.abspath(self.args.destination or '.')
+        return json.dumps(options, sort_keys=True, default=repr)
+
+    def skip_indexed(self, inputs):
+        """Drops the inputs whose output was already created by a previous
+        run and still exists."""
+        remaining = []
+        for input in inputs:
+            row = self.index_files.get(input.file.name)
+            if (row and row[:3] == input.stamp
+                    and row[6] == os.path.abspath(input.dest)
+                    and self.snapshot.exists(input.dest)):
+                self.log(2, 'already_created', 'skipping {dest!r} which was already created',
+                         dest=input.dest)
+            else:
+                remaining.append(input)
+        return remaining
+
+    def record_index(self, inputs, complete=True):
+        """Records the outputs created for `inputs`. Unless the run was
+        `complete`, the directory is not marked as unchanged, so the next run
+        retries the files which failed."""
+        source = os.path.abspath(self.source)
+        destination = os.path.abspath(self.args.destination or '.')
+        destination_mtime = os.stat(destination).st_mtime_ns
+        if not complete:
+            source_mtime = -1
+        elif source == destination and inputs:
+            # our own outputs changed the directory, but so may a file which
+            # arrived meanwhile, in which case it is scanned again next time
+            source_mtime = (destination_mtime
+                            if self.only_own_changes(source, destination_mtime) else -1)
+        else:
+            source_mtime = self.scanned_mtime
+        files = [(input.file.name,) + input.stamp
+                 + (input.parsed.season, input.parsed.episode, input.suffix,
+                    os.path.abspath(input.dest))
+                 for input in inputs]
+        self.index.record(source, self.job, source_mtime, destination_mtime, files)
+
+    def only_own_changes(self, directory, mtime):
+        """Returns whether `directory`, last modified at `mtime`, holds nothing
+        but the files it held when it was listed and those created since, and
+        didn't change while checking."""
+        listing = self.snapshot.listing(directory)
+        names = listing.listdir()
+        if listing.mtime() != mtime:
+            return False
+        return all(name in listing.entries or name.startswith(Index.NAME)
+                   for name in names)
+
+    def write_plan(self, inputs, path):
+        """Writes the operations for the given inputs to a plan file which can
+        be executed later with `--apply`. Each line holds a JSON array of the
+        output type, source, destination, extracted number and final number."""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(PLAN_HEADER + '\n')
+            for input in inputs or []:
+                if self.args.output_type == 'move':
+                    source = os.path.abspath(input.file)
+                else:
+                    source = str(self.snapshot.resolve(input.file))
+                operation = [self.args.output_type, source,
+                             os.path.abspath(input.dest),
+                             str(input.parsed), str(input.number)]
+                f.write(json.dumps(operation, ensure_ascii=False) + '\n')
+        self.log(1, 'wrote_plan', 'wrote {count} operations to {path!r}',
+                 count=len(inputs or []), path=path)
+
+    def read_plan(self, path):
+        """Reads a plan file written by `write_plan`. Returns the output type
+        and the inputs."""
+        output_types = set()
+        inputs = []
+        with open(path, encoding='utf-8') as f:
+            if f.readline().rstrip('\n') != PLAN_HEADER:
+                raise EpRenameError('{!r} is not a plan written by `--plan-out`'
+                                    .format(path))
+            for number, line in enumerate(f, 2):
+                if not line.strip():
+                    continue
+                try:
+                    output_type, source, dest, _, _ = json.loads(line)
+                    if not all(isinstance(p, str) and p for p in (source, dest)):
+                        raise ValueError('source and destination must be paths')
+                except (ValueError, TypeError):
+                    raise EpRenameError('line {} of the plan {!r} is not a valid operation'
+                                        .format(number, path))
+                if output_type not in OUTPUT_TYPES:
+                    raise EpRenameError('line {} of the plan {!r} has unknown output type '
+                                        '{!r}'.format(number, path, output_type))
+                output_types.add(output_type)
+                input = Input(Path(source))
+                input.dest = Path(dest)
+                inputs.append(input)
+        if len(output_types) > 1:
+            raise EpRenameError('plans mixing several output types are not '
+                                'supported')
+        return (output_types.pop() if output_types else None), inputs
+
+    def apply_plan(self, path):
+        """Executes a plan file without scanning or parsing anything. Progress
+        is journaled next to the plan so an interrupted apply resumes where it
+        stopped when run again."""
+        with self.auditing():
+            with self.stats.phase('read_plan'):
+                output_type, inputs = self.read_plan(path)
+            if output_type:
+                self.args.output_type = output_type
+            self.sources_resolved = True
+
+            journal = None if self.args.dry else Journal(path + '.journal')
+            if journal:
+                if journal.done:
+                    self.log(1, 'resuming', 'resuming; {count} operations were already applied',
+                             count=len(journal.done))
+                inputs = [input for input in inputs
+                          if str(input.dest) not in journal.done]
+                for input in inputs:
+                    if (str(input.dest) in journal.started
+                            and self.snapshot.exists(input.dest)):
+                        # left behind by the interrupted apply, possibly incomplete
+                        self.log(1, 'removing_partial', 'removing partial file {dest!r}',
+                                 dest=input.dest)
+                        self.snapshot.unlink(input.dest)
+
+            with self.stats.phase('overwrites'):
+                self.check_overwrites(inputs)
+            try:
+                self.apply(inputs, journal)
+            finally:
+                if journal:
+                    journal.close()
+                self.snapshot.close()
+                self.report_stats()
+            if journal and os.path.exists(journal.path):
+                os.unlink(journal.path)
+
+    def auditing(self):
+        """Counts filesystem calls while running with `--stats`."""
+        if self.args.stats:
+            return self.stats.auditing()
+        return contextlib.nullcontext()
+
+    def report_stats(self):
+        # messages about the run come before its report
+        self.logger.flush()
+        if self.args.stats:
+            print(self.stats.report(self.source, self.snapshot_counts(),
+                                    self.args.stats))
 
-        self.try_renumber(inputs)
+    def run(self):
+        if self.args.watch:
+            # start watching before scanning so no arrival is missed
+            try:
+                inotify = Inotify(self.source,
+                                  Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO)
+            except OSError as e:
+                raise EpRenameError('cannot watch {!r}: {}'
+                                    .format(str(self.source), e))
+        self.open_index(create=not self.args.dry)
+        try:
+            with self.auditing():
+                inputs = self.plan()
+                if self.args.plan_out:
+                    with self.stats.phase('write_plan'):
+                        self.write_plan(inputs, self.args.plan_out)
+                    return
+                self.apply(inputs)
+        finally:
+            # directories are opened again if watching
+            self.snapshot.close()
+            self.report_stats()
+        self.log_snapshot_counts()
+        self.logger.flush()
+        if self.args.watch:
+            self.watch(inotify)
+
+    def watch(self, inotify):
+        """Creates outputs for files as they finish arriving in the source
+        directory, checking them against the current plan instead of scanning
+        the directory again."""
+        self.log(1, 'watching', 'watching {source!r} for new files', source=self.source)
+        self.logger.flush()
+        sources = {input.file.name for input in self.planned.values()}
+        outputs = {os.path.abspath(dest) for dest in self.planned}
+        try:
+            for name in inotify.events():
+                if name is None:
+                    self.log(0, 'missed_files', 'warning: too many files arrived at once '
+                                'and some were missed; run again to pick them up')
+                    self.logger.flush()
+                    continue
+                path = self.source / name
+                if (name in sources or name.startswith(Index.NAME)
+                        or os.path.abspath(path) in outputs):
+                    # already handled, or one of our own outputs
+                    continue
+                self.snapshot.created(path)
+                input = self.extract_indexed_input(path) if self.index \
+                        else self.extract_input(path)
+                if input and self.watch_input(input):
+                    sources.add(name)
+                    outputs.add(os.path.abspath(input.dest))
+                # show what was done with each arrival right away
+                self.logger.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            inotify.close()
+            self.snapshot.close()
+            self.logger.flush()
+
+    def watch_input(self, input):
+        """Plans and applies a single newly arrived input. Problems are
+        reported without stopping. Returns whether an output was created."""
+        inputs = [input]
         self.try_strip_leading_zeros(inputs)
         self.try_add_or_strip_season(inputs)
         self.try_zero_pad(inputs)
         self.calc_destinations(inputs)
+        dest = input.dest
+
+        # refresh what we know about the destination as others may have
+        # changed it since it was listed
+        if self.snapshot.lexists(dest):
+            self.snapshot.created(dest)
+        else:
+            self.snapshot.removed(dest)
+
+        existing = self.planned.get(dest)
+        if existing:
+            if self.args.resolve_overlaps == 'error':
+                self.log(0, 'ignored_overlap',
+                         'warning: ignoring {file!r} because {existing!r} already maps '
+                         'to {dest!r}', file=input.file, existing=existing.file, dest=dest)
+                return False
+            try:
+                chosen, _ = self.choose_overlap([existing, input])
+            except EpRenameError as e:
+                self.log(0, 'ignored_overlap', 'warning: ignoring {file!r}; {error}',
+                         file=input.file, error=str(e))
+                return False
+            if chosen is existing:
+                if self.args.verbose >= 1:
+                    self.log(1, 'chose_overlap', CHOSE_OVERLAP, chosen=existing.file,
+                             dest=dest, ignored=[input.file])
+                return False
+            if self.args.verbose >= 1:
+                self.log(1, 'chose_overlap', CHOSE_OVERLAP, chosen=input.file, dest=dest,
+                         ignored=[existing.file])
+            if not self.args.dry and self.snapshot.exists(dest):
+                self.snapshot.unlink(dest)
+        elif self.snapshot.exists(dest) and self.args.sync and self.is_synced(input):
+            self.log(2, 'already_correct', 'leaving {dest!r} which is already correct',
+                     dest=dest)
+            self.planned[dest] = input
+            return False
+        elif self.snapshot.exists(dest) and not (self.args.overwrite or self.args.sync):
+            self.log(0, 'existing_output',
+                     'warning: ignoring {file!r} because {dest!r} already exists; use '
+                     'the `--overwrite` flag to replace it', file=input.file, dest=dest)
+            return False
+
+        try:
+            self.apply(inputs)
+        except EpRenameError:
+            # the error was already reported by `apply`
+            return False
+        self.planned[dest] = input
+        return True
+
+    def snapshot_counts(self):
+        """Returns the number of lookups the snapshot answered and syscalls it
+        performed for this program, not counting those of earlier programs
+        sharing it."""
+        lookups, syscalls = self.snapshot.counts()
+        return lookups - self.snapshot_start[0], syscalls - self.snapshot_start[1]
+
+    def log_snapshot_counts(self):
+        if self.args.verbose < 2:
+            return
+        lookups, syscalls = self.snapshot_counts()
+        self.log(2, 'snapshot', 'snapshot: answered {lookups} lookups with {syscalls} '
+                    'syscalls, saving {saved}',
+                 lookups=lookups, syscalls=syscalls, saved=lookups - syscalls)
+
+    def plan(self):
+        stats = self.stats
+        # the index may not exist yet, or only be created when applying
+        indexing = self.job is not None
+        if indexing:
+            with stats.phase('index'):
+                # the directories are checked before listing them, so an
+                # unchanged one isn't listed at all, and a file arriving while
+                # listing changes the directory after the recorded time
+                source = os.path.abspath(self.source)
+                self.scanned_mtime = os.stat(source).st_mtime_ns
+                destination_mtime = os.stat(self.args.destination or '.').st_mtime_ns
+                outputs = set()
+                if self.index:
+                    stored = self.index.directory(source, self.job)
+                    if stored == (self.scanned_mtime, destination_mtime) \
+                            and not self.args.watch:
+                        self.log(1, 'unchanged_directory',
+                                 'skipping unchanged directory {source!r}',
+                                 source=self.source)
+                        return None
+                    self.index_files = self.index.files(source, self.job)
+                    # outputs of other jobs reading this directory are no
+                    # sources either
+                    outputs = self.index.outputs(source)
+
+        with stats.phase('scan'):
+            names = self.snapshot.files(self.source)
+        stats.count('files_scanned', len(names))
+        extract = None
+        if indexing:
+            with stats.phase('index'):
+                # don't mistake our own outputs or the index for source files
+                names = [name for name in names
+                         if not name.startswith(Index.NAME)
+                         and os.path.join(source, name) not in outputs]
+                extract = self.extract_indexed_input
+
+        # only the files up to the end of the window of `--skip`, `--first`
+        # and `--season-split` have to be sorted
+        skip = int(self.args.skip or 0)
+        stop = None
+        if self.args.first:
+            stop = skip + int(self.args.first)
+        if self.args.season_split:
+            stop = min(stop or sys.maxsize, skip + sum(self.args.season_split))
+
+        # extraction and selection are interleaved, so both are timed as one
+        with stats.phase('extract'):
+            if extract:
+                inputs = (extract(self.source / name) for name in names)
+                inputs = filter(None, inputs)
+            else:
+                inputs = self.extract_inputs(names)
+            if self.args.sync and self.outputs_in_source():
+                inputs = (input for input in inputs if not self.is_earlier_output(input))
+            inputs, matched = select_inputs_by_num(inputs, stop)
+        stats.count('files_matched', matched)
+
+        if skip:
+            if skip >= matched:
+                self.log(0, 'skipped_all', 'warning: skipping all files')
+            inputs = inputs[skip:]
 
-        self.check_overlaps(inputs)
-        self.check_overwrites(inputs)
-
-        if self.args.output_type == 'symlink':
-            method = lambda new, old: new.symlink_to(old)
-            msg = 'created symbolic link from {new!r} to {old!r}'
-        elif self.args.output_type == 'hardlink':
-            method = lambda new, old: new.link_to(old)
-            msg = 'created hard link from {new!r} to {old!r}'
-        elif self.args.output_type == 'copy':
-            method = lambda new, old: shutil.copy2(old, new)
-            msg = 'copied file to {new!r} from {old!r}'
-        elif self.args.output_type == 'move':
-            method = lambda new, old: shutil.move(old, new)
-            msg = 'moved file to {new!r} from {old!r}'
+        if self.args.first:
+            first = int(self.args.first)
+            if first > matched - skip:
+                self.log(0, 'too_few_files',
+                         'warning: there are only {count} files but given --first={first}',
+                         count=max(matched - skip, 0), first=first)
+            inputs = inputs[:first]
 
+        if self.args.season_split:
+            total = sum(self.args.season_split)
+            remaining = matched - skip
+            if self.args.first:
+                remaining = min(remaining, int(self.args.first))
+            if total < remaining:
+                self.log(0, 'beyond_season_split',
+                         'warning: ignoring {count} files beyond the last season of '
+                         '--season-split', count=remaining - total)
+                inputs = inputs[:total]
+            elif total > len(inputs):
+                self.log(0, 'too_few_files',
+                         'warning: there are only {count} files but --season-split '
+                         'covers {total}', count=len(inputs), total=total)
+
+        with stats.phase('renumber'):
+            self.try_renumber(inputs)
+            self.try_strip_leading_zeros(inputs)
+            self.try_add_or_strip_season(inputs)
+            self.try_zero_pad(inputs)
+            self.calc_destinations(inputs)
+
+        with stats.phase('overlaps'):
+            self.check_overlaps(inputs)
+        self.planned = {input.dest: input for input in inputs}
+        if indexing:
+            with stats.phase('index'):
+                inputs = self.skip_indexed(inputs)
+        if self.args.sync:
+            with stats.phase('sync'):
+                inputs = self.skip_synced(inputs)
+                if self.args.prune:
+                    self.stale = self.find_stale()
+        with stats.phase('overwrites'):
+            self.check_overwrites(inputs)
+        return inputs
+
+    def is_synced(self, input):
+        """Returns whether the existing destination of `input` already is the
+        output which would be created for it."""
+        dest = input.dest
+        try:
+            if self.args.output_type == 'symlink':
+                if not self.snapshot.is_symlink(dest):
+                    return False
+                source = str(self.snapshot.resolve(input.file))
+                return (self.snapshot.readlink(dest) == source
+                        or os.path.realpath(dest) == source)
+            if self.snapshot.is_symlink(dest):
+                return False
+            st = self.snapshot.stat(dest)
+            source = self.snapshot.stat(input.file)
+        except OSError:
+            return False
+        if self.args.output_type == 'hardlink':
+            return (st.st_dev, st.st_ino) == (source.st_dev, source.st_ino)
+        # copies keep the size and modification time of their source
+        return (st.st_size, st.st_mtime_ns) == (source.st_size, source.st_mtime_ns)
+
+    def outputs_in_source(self):
+        """Returns whether outputs are created in the source directory."""
+        source = os.path.realpath(self.source)
+        return source == os.path.realpath(self.args.destination or '.')
+
+    def is_earlier_output(self, input):
+        """With `--sync` into the source directory, the outputs of earlier runs
+        are listed along with the sources. Returns whether `input` is one of
+        them: a symbolic link to another file of the directory, or a file
+        already named like the output for its own number."""
+        name = '{} {}.{}'.format(self.args.title, input.number, input.suffix)
+        if input.file.name == name:
+            return True
+        if not self.snapshot.is_symlink(input.file):
+            return False
+        target = self.snapshot.resolve(input.file)
+        return (os.path.dirname(target) == os.path.realpath(self.source)
+                and self.snapshot.exists(self.source / target.name))
+
+    def skip_synced(self, inputs):
+        """Drops the inputs whose destination already is the right output for
+        `--sync`. Those remaining create missing outputs or replace wrong
+        ones."""
+        remaining = []
         for input in inputs:
-            old = input['file']
-            new = input['dest']
-
-            if self.args.output_type != 'move':
-                old = old.resolve()
+            if not self.snapshot.exists(input.dest):
+                remaining.append(input)
+            elif self.is_synced(input):
+                self.log(2, 'already_correct', 'leaving {dest!r} which is already correct',
+                         dest=input.dest)
+            else:
+                self.log(2, 'replacing_wrong',
+                         'replacing {dest!r} which is not the expected output',
+                         dest=input.dest)
+                remaining.append(input)
+        self.log(1, 'sync', 'sync: {correct} outputs are already correct, {remaining} to '
+                    'create or replace',
+                 correct=len(self.planned) - len(remaining), remaining=len(remaining))
+        return remaining
+
+    def find_stale(self):
+        """Returns the symbolic links in the destination which point to files
+        of the source directory that are not the source of any input. Links
+        to planned sources under other names are left to whoever made them."""
+        destination = Path(self.args.destination or './')
+        directory = os.path.abspath(destination)
+        source = os.path.realpath(self.source)
+        sources = set()
+        for input in self.planned.values():
+            # links are made to the resolved source
+            sources.add(input.file.name)
+            sources.add(self.snapshot.resolve(input.file).name)
+        stale = []
+        for name in list(self.snapshot.listing(destination).entries):
+            path = destination / name
+            if path in self.planned or not self.snapshot.is_symlink(path):
+                continue
+            try:
+                target = os.path.join(directory, self.snapshot.readlink(path))
+            except OSError:
+                continue
+            target = os.path.normpath(target)
+            if (os.path.dirname(target) == source
+                    and os.path.basename(target) not in sources):
+                stale.append(path)
+        return stale
+
+    def prune(self):
+        """Removes the stale links found by `find_stale`. Returns the number
+        which could not be removed."""
+        failed = 0
+        for path in self.stale:
+            if self.args.dry:
+                self.log(1, 'pruned', 'removed stale link {path!r}', path=path, dry=True)
+                continue
+            try:
+                self.snapshot.unlink(path)
+            except OSError as e:
+                self.log(0, 'prune_failed', 'error: could not remove {path!r}: {error}',
+                         path=path, error=str(e))
+                failed += 1
+                continue
+            self.stats.count('files_pruned')
+            self.log(1, 'pruned', 'removed stale link {path!r}', path=path, dry=False)
+        self.stale = []
+        return failed
+
+    def apply(self, inputs, journal=None):
+        with self.stats.phase('apply'):
+            if inputs is None:
+                # nothing changed since the last run
+                return
+
+            # the methods are given the destination and source as pairs of a
+            # name and the descriptor of its directory, and the resolved source
+            copying = False
+            if self.args.output_type == 'symlink':
+                method = lambda dst, src, old: os.symlink(old, dst[0], dir_fd=dst[1])
+                msg = 'created symbolic link from {new!r} to {old!r}'
+            elif self.args.output_type == 'hardlink':
+                method = lambda dst, src, old: os.link(src[0], dst[0], src_dir_fd=src[1],
+                                                       dst_dir_fd=dst[1])
+                msg = 'created hard link from {new!r} to {old!r}'
+            elif self.args.output_type == 'reflink':
+                method = lambda dst, src, old: copy_file(src[0], dst[0], True,
+                                                         src[1], dst[1])
+                msg = 'cloned file to {new!r} from {old!r}'
+                copying = True
+            elif self.args.output_type == 'copy':
+                method = lambda dst, src, old: copy_file(src[0], dst[0], False,
+                                                         src[1], dst[1])
+                msg = 'copied file to {new!r} from {old!r}'
+                copying = True
+            elif self.args.output_type == 'move':
+                method = lambda dst, src, old: move_file(src[0], dst[0], src[1], dst[1])
+                msg = 'moved file to {new!r} from {old!r}'
+
+            operations = []
+            # sizes of the files to move, for `--stats`
+            sizes = {}
+            for input in inputs:
+                old = input.file
+                new = input.dest
 
-            if not self.args.dry:
-                if self.args.overwrite and new.exists():
-                    self.log(0, 'removing existing file ' + repr(str(new)))
-                    new.unlink()
-                method(new, old)
-            self.log(1, msg.format(new=str(new), old=str(old)))
+                if self.sources_resolved:
+                    src = (str(old), None)
+                else:
+                    listing, name = self.snapshot.locate(old)
+                    src = listing.at(name)
+                    if self.args.output_type != 'move':
+                        old = listing.resolve(name)
+
+                listing, name = self.snapshot.locate(new)
+                dst = listing.at(name)
+                replace = ((self.args.overwrite or self.args.sync)
+                           and name in listing.entries)
+                if self.args.stats and self.args.output_type == 'move':
+                    sizes[new] = self.snapshot.stat(old).st_size
+                if not self.args.dry:
+                    if replace:
+                        self.log(0, 'removing_existing', 'removing existing file {new!r}',
+                                 new=new)
+                    if journal:
+                        journal.start(new)
+                operations.append((input, new, old, replace, dst, src))
+
+            if self.args.dry:
+                for _, new, old, *_ in operations:
+                    self.log(1, 'created', msg, new=new, old=old,
+                             output_type=self.args.output_type, dry=True)
+                self.prune()
+                return
+
+            def perform(operation):
+                # errors are returned rather than raised so they only affect
+                # their own file
+                _, _, old, replace, dst, src = operation
+                try:
+                    if replace:
+                        os.unlink(dst[0], dir_fd=dst[1])
+                    return method(dst, src, old), None
+                except OSError as e:
+                    return None, e
+
+            jobs = int(self.args.io_jobs or (4 if copying else 1))
+            copied = cloned = 0
+            succeeded = []
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                # each operation mostly waits on the filesystem, for a round trip
+                # on network mounts or for the data when copying, so several are
+                # kept in flight
+                mapper = pool.map if jobs > 1 else map
+                results = mapper(perform, operations)
+                for (input, new, old, replace, *_), (result, error) in zip(operations,
+                                                                           results):
+                    if error:
+                        if replace and not self.snapshot.lexists(new):
+                            self.snapshot.removed(new)
+                        self.log(0, 'create_failed', 'error: could not create {new!r}: {error}',
+                                 new=new, old=old, error=str(error))
+                        continue
+                    self.snapshot.created(new)
+                    if self.args.output_type == 'move':
+                        self.snapshot.removed(input.file)
+                        self.stats.count('bytes_moved', sizes.get(new, 0))
+                    if copying:
+                        copied += result[0]
+                        cloned += result[1]
+                    if replace:
+                        self.stats.count('files_replaced')
+                    if journal:
+                        journal.finish(new)
+                    succeeded.append(input)
+                    self.log(1, 'created', msg, new=new, old=old,
+                             output_type=self.args.output_type, dry=False)
+            elapsed = time.perf_counter() - start
+
+            failed = len(operations) - len(succeeded)
+            self.stats.count('files_created', len(succeeded))
+            if copying:
+                self.stats.count('bytes_copied', copied)
+                self.stats.count('bytes_cloned', cloned)
+            if self.stale:
+                failed += self.prune()
+            if self.index and self.args.output_type != 'move':
+                self.record_index(succeeded, complete=not failed)
+
+            if copying and operations and self.args.verbose >= 1:
+                self.log(1, 'copy_throughput',
+                         'copied {copied} and cloned {cloned} in {seconds:.2f}s ({rate}/s)',
+                         copied=format_size(copied), cloned=format_size(cloned),
+                         seconds=elapsed, rate=format_size(copied / elapsed if elapsed else 0))
+
+            if failed:
+                raise EpRenameError('{} files could not be created or removed'
+                                    .format(failed))
 
     def log_renumbered(self, func, input, old, new):
         if old != new:
-            self.log(2, '{}: renumbered {!r} from {} to {}'
-                        .format(func, str(input['file']), old, new))
+            self.log(2, 'renumbered', '{step}: renumbered {file!r} from {old} to {new}',
+                     step=func, file=input.file, old=old, new=new)
+
+    def split_seasons(self, inputs):
+        """Returns a list of (season, inputs) pairs following `--season-split`,
+        or a single pair covering all inputs if it was not specified."""
+        if not self.args.season_split:
+            return [(self.args.season, inputs)]
+
+        seasons = []
+        season = int(self.args.season or 1)
+        start = 0
+        for length in self.args.season_split:
+            seasons.append((str(season), inputs[start:start + length]))
+            season += 1
+            start += length
+        return seasons
 
     def try_renumber(self, inputs):
         if self.args.renumber:
-            i = int(self.args.renumber_start)
-            for input in inputs:
-                old = input['number']
-                new = Number(old.season, str(i))
-                input['number'] = new
-                i += 1
-                self.log_renumbered('renumber', input, old, new)
+            for _, season_inputs in self.split_seasons(inputs):
+                i = int(self.args.renumber_start)
+                for input in season_inputs:
+                    old = input.number
+                    new = old.replace(old.season, str(i))
+                    input.number = new
+                    i += 1
+                    self.log_renumbered('renumber', input, old, new)
 
     def try_add_or_strip_season(self, inputs):
-        if self.args.season:
-            for input in inputs:
-                old = input['number']
-                new = Number(self.args.season, old.episode)
-                input['number'] = new
-                self.log_renumbered('add_season', input, old, new)
+        if self.args.season or self.args.season_split:
+            for season, season_inputs in self.split_seasons(inputs):
+                for input in season_inputs:
+                    old = input.number
+                    new = old.replace(season, old.episode)
+                    input.number = new
+                    self.log_renumbered('add_season', input, old, new)
         elif self.args.strip_season:
             for input in inputs:
-                old = input['number']
-                new = Number(None, old.episode)
-                input['number'] = new
+                old = input.number
+                new = old.replace(None, old.episode)
+                input.number = new
                 self.log_renumbered('strip_season', input, old, new)
 
 
     def try_strip_leading_zeros(self, inputs):
         if self.args.strip_leading_zeros:
             for input in inputs:
-                old = input['number']
-                new = Number(None, None)
-                new.episode = new.episode.lstrip('0') or '0'
-                new.season = new.season.lstrip('0') or '0'
-                input['number'] = new
+                old = input.number
+                season = old.season and (old.season.lstrip('0') or '0')
+                episode = old.episode.lstrip('0') or '0'
+                new = old.replace(season, episode)
+                input.number = new
                 self.log_renumbered('strip_leading_zeros', input, old, new)
 
     def try_zero_pad(self, inputs):
         if self.args.zero_pad:
-            if type(self.args.zero_pad) is AUTO_ZERO_PAD:
-                width = max(map(lambda input: len(str(int(input['number'].episode))), inputs))
+            if self.zero_pad_width is not None:
+                # keep the width of the initial run while watching
+                width = self.zero_pad_width
+            elif type(self.args.zero_pad) is AUTO_ZERO_PAD:
+                width = max((len(str(input.number.key[1])) for input in inputs), default=1)
             else:
                 width = int(self.args.zero_pad)
+            self.zero_pad_width = width
 
             fmt = '{{:0>{}}}'.format(width)
             for input in inputs:
-                old = input['number']
-                new = Number(old.season, fmt.format(int(old.episode)))
-                input['number'] = new
+                old = input.number
+                new = old.replace(old.season, fmt.format(old.key[1]))
+                input.number = new
                 self.log_renumbered('zero_pad', input, old, new)
 
     def calc_destinations(self, inputs):
+        destination = Path(self.args.destination or './')
         for input in inputs:
-            name = '{} {number}.{suffix}'.format(self.args.title, **input)
-            input['dest'] = Path(self.args.destination or './', name)
+            name = '{} {}.{}'.format(self.args.title, input.number, input.suffix)
+            input.dest = destination / name
 
     def check_overwrites(self, inputs):
-        if not self.args.overwrite:
-            oops = [d for d in map(lambda input: input['dest'], inputs) if d.exists()]
+        if not self.args.overwrite and not self.args.sync:
+            oops = [d for d in map(lambda input: input.dest, inputs)
+                    if self.snapshot.exists(d)]
             if len(oops) > 0:
-                self.log(0, 'the following files already exist:')
+                lines = ['the following files already exist:']
                 for oop in oops:
-                    self.log(0, '  ' + str(oop))
-                self.log(0, '')
-                self.log(0, 'use the `--overwrite` flag to ignore these.')
-                sys.exit(1)
+                    lines.append('  ' + str(oop))
+                lines.append('')
+                lines.append('use the `--overwrite` flag to ignore these.')
+                raise EpRenameError('\n'.join(lines))
+
+    def choose_overlap(self, sources):
+        """Picks one of several sources which map to the same output following
+        `--resolve-overlaps`. Returns the chosen source and the ignored ones."""
+        def oldest(paths):
+            sort_inputs_by_time(paths, self.snapshot)
+            return paths[0], paths[1:]
+
+        def newest(paths):
+            sort_inputs_by_time(paths, self.snapshot)
+            return paths[-1], paths[:-1]
+
+        def any(paths):
+            return paths[0], paths[1:]
+
+        def identical(paths):
+            if not self.identical(paths):
+                sort_inputs_by_time(paths, self.snapshot)
+                lines = ['the following files all map to {!r} but are not identical:'
+                         .format(str(paths[0].dest))]
+                lines.extend('  ' + str(path.file) for path in paths)
+                raise EpRenameError('\n'.join(lines))
+            return oldest(paths)
+
+        methods = {
+            'oldest': oldest,
+            'newest': newest,
+            'any': any,
+            'identical': identical,
+        }
+        return methods[self.args.resolve_overlaps](sources)
+
+    def digest(self, input, st, sample):
+        """Hashes the contents of the source of `input` whose stat result is
+        `st`, reusing earlier digests if the file is unchanged since."""
+        key = (st.st_dev, st.st_ino, sample, st.st_size, st.st_mtime_ns)
+        digest = self.digests.get(key)
+        if digest is None and self.index:
+            digest = self.index.digest(*key)
+        if digest is None:
+            self.log(2, 'hashing', 'hashing {extent} {file!r}',
+                     extent='samples of' if sample else 'all of', file=input.file)
+            try:
+                name, fd = self.snapshot.at(input.file)
+                digest = hash_file(name, st.st_size, sample, fd)
+            except OSError as e:
+                raise EpRenameError('could not read {!r}: {}'.format(str(input.file), e))
+            if self.index:
+                self.index.record_digest(*key, digest)
+        self.digests[key] = digest
+        return digest
+
+    def identical(self, inputs):
+        """Returns whether the sources of all `inputs` have the same contents,
+        reading as little as possible: files of different sizes are never
+        read, and files are only hashed fully if their samples agree."""
+        stats = [self.snapshot.stat(input.file) for input in inputs]
+        size = stats[0].st_size
+        if any(st.st_size != size for st in stats):
+            return False
+        if size == 0 or len({(st.st_dev, st.st_ino) for st in stats}) == 1:
+            # empty, or hard links to a single file
+            return True
+        for sample in (True, False):
+            if len({self.digest(input, st, sample)
+                    for input, st in zip(inputs, stats)}) > 1:
+                return False
+            if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+                # the samples covered the whole files
+                break
+        return True
 
     def check_overlaps(self, inputs):
-        if len(inputs) == len(set(map(lambda input: input['dest'], inputs))):
+        # group in a single pass; appending in place keeps this linear even
+        # when every input maps to the same output
+        sources_dict = {}
+        for input in inputs:
+            sources_dict.setdefault(input.dest, []).append(input)
+
+        if len(sources_dict) == len(inputs):
             # each input maps to a unique output
             return
 
-        sources_dict = {}
-        for input in inputs:
-            dest = str(input['dest'])
-            src = input
-            sources_dict[dest] = sources_dict.get(dest, []) + [src]
-        oops = filter((lambda item: len(item[1]) > 1), sources_dict.items())
-        oops = sorted(oops)
+        oops = [(str(dest), sources) for dest, sources in sources_dict.items()
+                if len(sources) > 1]
+        oops.sort(key=lambda item: item[0])
 
         if self.args.resolve_overlaps == 'error':
+            lines = []
             for dest, sources in oops:
-                sort_inputs_by_time(sources)
-                self.log(0, 'the following files all map to {!r}:'.format(dest))
+                sort_inputs_by_time(sources, self.snapshot)
+                lines.append('the following files all map to {!r}:'.format(dest))
                 for src in sources:
-                    self.log(0, '  ' + str(src['file']))
-            self.log(0, '')
-            self.log(0, 'use the `--resolve-overlaps` flag to proceed')
-            self.log(0, 'files above are already shown in ascending date order')
-            sys.exit(1)
+                    lines.append('  ' + str(src.file))
+            lines.append('')
+            lines.append('use the `--resolve-overlaps` flag to proceed')
+            lines.append('files above are already shown in ascending date order')
+            raise EpRenameError('\n'.join(lines))
         else:
-            def oldest(paths):
-                sort_inputs_by_time(paths)
-                return paths[0], paths[1:]
-
-            def newest(paths):
-                sort_inputs_by_time(paths)
-                return paths[-1], paths[:-1]
-
-            def any(paths):
-                return paths[0], paths[1:]
-
-            methods = {
-                'oldest': oldest,
-                'newest': newest,
-                'any': any,
-            }
-            method = methods[self.args.resolve_overlaps]
-
-            remove = []
-            self.log(1, 'using overlap resolution: ' + self.args.resolve_overlaps)
-            for _, sources in oops:
-                chosen, ignored = method(sources)
-                self.log(1, 'choosing {!r} for {!r} in favor of {!r}'
-                            .format(str(chosen['file']), dest, [str(i['file']) for i in ignored]))
-                remove += ignored
-
-            for input in remove:
-                # O(n^2) but who will have 1000 files all overlapping? ....
-                # Much easier than trying to perform set operations dicts
-                inputs.remove(input)
+            remove = set()
+            unresolved = []
+            self.log(1, 'overlap_resolution', 'using overlap resolution: {strategy}',
+                     strategy=self.args.resolve_overlaps)
+            for dest, sources in oops:
+                try:
+                    chosen, ignored = self.choose_overlap(sources)
+                except EpRenameError as e:
+                    unresolved.append(str(e))
+                    continue
+                if self.args.verbose >= 1:
+                    self.log(1, 'chose_overlap', CHOSE_OVERLAP, chosen=chosen.file,
+                             dest=dest, ignored=[i.file for i in ignored])
+                remove.update(ignored)
+            if unresolved:
+                unresolved.append('')
+                unresolved.append('use another `--resolve-overlaps` choice to pick one '
+                                  'of them')
+                raise EpRenameError('\n'.join(unresolved))
+
+            inputs[:] = [input for input in inputs if input not in remove]
+
+class Plan(list):
+    """The inputs planned by `plan`, ready to be passed to `apply`. Each has
+    its source `file`, final `number`, `suffix` and destination `dest`."""
+    def __init__(self, program, inputs):
+        super().__init__(inputs)
+        self.program = program
+
+def plan(directory='.', entries=None, **options):
+    """Plans renaming the episodes in `directory` without modifying anything.
+
+    The options are named like the long command line flags, such as
+    `title='Show'`, `season_split=[13, 13]` or `zero_pad=True` for automatic
+    padding. Outputs are created in `directory` unless `destination` is given.
+    If `entries` is given, it is used instead of listing `directory`; it may
+    hold `os.DirEntry` objects or the names of regular files.
+
+    Raises `EpRenameError` if the files cannot be renamed as requested."""
+    args = argparser.parse_args([])
+    for name, value in options.items():
+        if name in ('library', 'manifest', 'watch', 'apply', 'plan_out') \
+                or not hasattr(args, name):
+            raise TypeError('plan() got an unsupported option {!r}'.format(name))
+        setattr(args, name, value)
+    if args.zero_pad is True:
+        args.zero_pad = AUTO_ZERO_PAD()
+    if args.destination is None:
+        args.destination = str(directory)
+    validate_args(args)
+
+    program = Program(args, Path(directory))
+    if entries is not None:
+        program.snapshot.preload(directory, entries)
+    program.open_index(create=False)
+    try:
+        return Plan(program, program.plan() or [])
+    finally:
+        program.logger.flush()
+
+def apply(plan):
+    """Performs a plan returned by `plan`. Raises `EpRenameError` or `OSError`
+    if it cannot be performed."""
+    try:
+        # planning only read the index
+        plan.program.open_index()
+        plan.program.apply(list(plan))
+    finally:
+        plan.program.snapshot.close()
+        plan.program.logger.flush()
+
+def find_shows(root, unreadable):
+    """Yields every leaf directory below `root`, including `root` itself if it
+    has no subdirectories. Directories which cannot be listed are appended
+    to `unreadable` along with the error instead."""
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        try:
+            with os.scandir(path) as entries:
+                subdirs = [e.path for e in entries if e.is_dir(follow_symlinks=False)]
+        except OSError as e:
+            unreadable.append((path, e))
+            continue
+        if subdirs:
+            pending.extend(sorted(subdirs, reverse=True))
+        else:
+            yield path
+
+def show_args(args, path):
+    """Derives the arguments for a single show in `--library` mode."""
+    args = argparse.Namespace(**vars(args))
+    args.title = Path(path).name
+    args.destination = path
+    return args
+
+def print_error(args, e):
+    """Reports an error which stopped a run, such as an `EpRenameError`, in
+    the `--log-format` of its messages."""
+    if args.log_format == 'json':
+        e = json.dumps({'event': 'error', 'level': 0, 'message': str(e)})
+    print(e, file=sys.stderr)
+
+def run_show(args, path):
+    """Entry point for `--library` worker processes. Returns whether the show
+    was processed successfully."""
+    try:
+        Program(args, Path(path)).run()
+        return True
+    except EpRenameError as e:
+        print_error(args, e)
+    except (OSError, sqlite3.Error) as e:
+        print_error(args, 'cannot process {!r}: {}'.format(path, e))
+    return False
+
+def run_library(args):
+    unreadable = []
+    shows = list(find_shows(args.library, unreadable))
+    for path, e in unreadable:
+        print_error(args, 'cannot list {!r}: {}'.format(path, e))
+    show_argss = [show_args(args, path) for path in shows]
+    jobs = int(args.jobs) if args.jobs else os.cpu_count()
+    chunksize = max(1, len(shows) // (jobs * 4))
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(run_show, show_argss, shows, chunksize=chunksize)
+        failed = [path for path, _ in unreadable]
+        failed += [path for path, ok in zip(shows, results) if not ok]
+
+    if failed:
+        raise EpRenameError('\n'.join(['the following shows could not be '
+                                        'processed:']
+                                       + ['  ' + path for path in failed]))
+
+# options which only make sense for the whole run rather than for each show
+MANIFEST_UNSUPPORTED = {'library', 'manifest', 'jobs', 'watch', 'apply', 'plan_out',
+                        'log_format'}
+
+def read_manifest(path):
+    """Returns the list of shows in a `--manifest` file."""
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise EpRenameError('TOML manifests need Python 3.11 or later; '
+                                'use a JSON manifest instead')
+        load = tomllib.load
+    else:
+        load = json.load
+    try:
+        with open(path, 'rb') as f:
+            data = load(f)
+    except (OSError, ValueError) as e:
+        raise EpRenameError('cannot read `--manifest` {!r}: {}'.format(path, e))
+    shows = data.get('shows') if isinstance(data, dict) else data
+    if not isinstance(shows, list) or not all(isinstance(s, dict) for s in shows):
+        raise EpRenameError('`--manifest` must hold a list of shows, each a table '
+                            + 'of options')
+    return shows
+
+def manifest_args(args, base, show):
+    """Derives the source directory and arguments for a single show listed in
+    a `--manifest` whose relative paths are relative to `base`."""
+    options = {name.replace('-', '_'): value for name, value in show.items()}
+    source = options.pop('source', None)
+    if not isinstance(source, str) or not source:
+        raise EpRenameError('every show in `--manifest` must have a `source` directory')
+    source = os.path.join(base, source)
+    if not Path(source).is_dir():
+        raise EpRenameError('`source` {!r} in `--manifest` must refer to a valid '
+                            'directory'.format(source))
+
+    args = show_args(args, source)
+    args.manifest = None
+    for name, value in options.items():
+        if name in MANIFEST_UNSUPPORTED or not hasattr(args, name):
+            raise EpRenameError('unsupported option {!r} for {!r} in `--manifest`'
+                                .format(name, source))
+        setattr(args, name, value)
+    if args.zero_pad is True:
+        args.zero_pad = AUTO_ZERO_PAD()
+    if 'destination' in options:
+        args.destination = os.path.join(base, args.destination)
+    try:
+        validate_args(args)
+        # compiled now so bad formats are reported before anything is
+        # modified; the result is cached for the run
+        compile_input_fmts(tuple(args.input_fmt))
+    except EpRenameError as e:
+        raise EpRenameError('{} (for {!r} in `--manifest`)'.format(e, source))
+    return source, args
+
+def run_manifest(args):
+    base = os.path.dirname(args.manifest)
+    # validate every show before modifying anything
+    shows = [manifest_args(args, base, show) for show in read_manifest(args.manifest)]
+
+    # directories shared between shows are only listed once
+    snapshot = Snapshot()
+    failed = []
+    for source, show in shows:
+        try:
+            Program(show, Path(source), snapshot).run()
+        except EpRenameError as e:
+            print_error(show, e)
+            failed.append(source)
+        except (OSError, sqlite3.Error) as e:
+            print_error(show, 'cannot process {!r}: {}'.format(source, e))
+            failed.append(source)
+
+    if failed:
+        raise EpRenameError('\n'.join(['the following shows could not be '
+                                        'processed:']
+                                       + ['  ' + path for path in failed]))
 
 def is_nonneg(s):
     try:
         return int(s) >= 0
-    except ValueError:
+    except (TypeError, ValueError):
         return False
 
-args = argparser.parse_args()
-
-if args.renumber and args.strip_leading_zeros:
-    argparser.error('cannot specify both `--renumber` and `--strip-leading-zeros`')
-
-if args.strip_leading_zeros and arg.zero_pad:
-    argparser.error('cannot specify both `--zero_pad` and `--strip-leading-zeros`')
-
-if args.destination and not Path(args.destination).is_dir():
-    argparser.error('`--destination` must refer to a valid directory')
-
-if args.zero_pad and not is_nonneg(args.zero_pad):
-    argparser.error('must specify a positive integer to `--zero-pad`')
-
-if args.first and not is_nonneg(args.first):
-    argparser.error('must specify a positive integer to `--first`')
-
-if args.skip and not is_nonneg(args.skip):
-    argparser.error('must specify a positive integer to `--skip`')
-
-if args.renumber_start and not is_nonneg(args.renumber_start):
-    argparser.error('must specify a positive integer to `--renumber_start`')
-
-if (args.skip or args.first) and not args.destination:
-    argparser.error('must specify a destination with `-d/--destination` while '
-                    + 'using `--skip` or `--first` because you most likely '
-                    + 'want to use this command more than once.')
-
-if args.season and args.strip_season:
-    argparser.error('cannot specify both `--season` and `--strip-season`')
-
-if args.skip and args.renumber is None:
-    args.renumber = True
-
-if args.strip_season and args.renumber is None:
-    args.renumber = True
+def validate_args(args):
+    """Checks the arguments for consistency and fills in the options implied
+    by others. Raises `EpRenameError` for invalid combinations."""
+    if not args.input_fmt:
+        args.input_fmt = ['%b%a%n%a.%f']
+    elif isinstance(args.input_fmt, str):
+        args.input_fmt = [args.input_fmt]
+
+    if args.renumber and args.strip_leading_zeros:
+        raise EpRenameError('cannot specify both `--renumber` and `--strip-leading-zeros`')
+
+    if args.strip_leading_zeros and args.zero_pad:
+        raise EpRenameError('cannot specify both `--zero_pad` and `--strip-leading-zeros`')
+
+    if args.library and args.manifest:
+        raise EpRenameError('cannot specify both `--library` and `--manifest`')
+
+    if args.library:
+        if args.title:
+            raise EpRenameError('cannot specify `--title` with `--library`; each '
+                                + 'show is titled after its directory')
+        if args.destination:
+            raise EpRenameError('cannot specify `--destination` with `--library`; '
+                                + 'files are created inside each show directory')
+        if not Path(args.library).is_dir():
+            raise EpRenameError('`--library` must refer to a valid directory')
+    elif args.manifest:
+        if args.title or args.destination:
+            raise EpRenameError('cannot specify `--title` or `--destination` with '
+                                + '`--manifest`; set them for each show instead')
+        if args.apply or args.watch or args.plan_out:
+            raise EpRenameError('cannot specify `--apply`, `--watch` or `--plan-out` '
+                                + 'with `--manifest`')
+        if not Path(args.manifest).is_file():
+            raise EpRenameError('`--manifest` must refer to a file')
+    elif not args.title and not args.apply:
+        raise EpRenameError('must specify a title with `-t/--title`')
+
+    if args.apply:
+        if args.plan_out or args.library or args.watch or args.index:
+            raise EpRenameError('cannot specify `--plan-out`, `--library`, `--watch` '
+                                + 'or `--index` with `--apply`')
+        if not Path(args.apply).is_file():
+            raise EpRenameError('`--apply` must refer to a plan file')
+
+    if args.sync:
+        if args.output_type == 'move':
+            raise EpRenameError('cannot specify `--sync` with the `move` output type')
+        if args.plan_out or args.apply:
+            raise EpRenameError('cannot specify `--sync` with `--plan-out` or `--apply`')
+
+    if args.prune:
+        if not args.sync:
+            raise EpRenameError('cannot specify `--prune` without `--sync`')
+        if args.skip or args.first:
+            raise EpRenameError('cannot specify `--prune` with `--skip` or `--first` '
+                                + 'as the links created for other files would be removed')
+
+    if args.plan_out and (args.library or args.watch):
+        raise EpRenameError('cannot specify `--plan-out` with `--library` or `--watch`')
+
+    if args.jobs and not (is_nonneg(args.jobs) and int(args.jobs) > 0):
+        raise EpRenameError('must specify a positive integer to `--jobs`')
+
+    if args.io_jobs and not (is_nonneg(args.io_jobs) and int(args.io_jobs) > 0):
+        raise EpRenameError('must specify a positive integer to `--io-jobs`')
+
+    if args.destination and not Path(args.destination).is_dir():
+        raise EpRenameError('`--destination` must refer to a valid directory')
+
+    if args.zero_pad and not is_nonneg(args.zero_pad):
+        raise EpRenameError('must specify a positive integer to `--zero-pad`')
+
+    if args.first and not is_nonneg(args.first):
+        raise EpRenameError('must specify a positive integer to `--first`')
+
+    if args.skip and not is_nonneg(args.skip):
+        raise EpRenameError('must specify a positive integer to `--skip`')
+
+    if args.renumber_start and not is_nonneg(args.renumber_start):
+        raise EpRenameError('must specify a positive integer to `--renumber_start`')
+
+    if (args.skip or args.first) and not args.destination and not args.library:
+        raise EpRenameError('must specify a destination with `-d/--destination` while '
+                            + 'using `--skip` or `--first` because you most likely '
+                            + 'want to use this command more than once.')
+
+    if args.season and args.strip_season:
+        raise EpRenameError('cannot specify both `--season` and `--strip-season`')
+
+    if args.season_split:
+        lengths = args.season_split
+        if isinstance(lengths, str):
+            lengths = lengths.split(',')
+        if not all(is_nonneg(n) and int(n) > 0 for n in lengths):
+            raise EpRenameError('must specify a comma separated list of positive '
+                                + 'integers to `--season-split`')
+        args.season_split = [int(n) for n in lengths]
+
+    if args.season_split and args.strip_season:
+        raise EpRenameError('cannot specify both `--season-split` and `--strip-season`')
+
+    if args.season_split and args.renumber is None:
+        args.renumber = True
+
+    if args.skip and args.renumber is None:
+        args.renumber = True
+
+    if args.strip_season and args.renumber is None:
+        args.renumber = True
+
+    if args.renumber and args.renumber_start is None:
+        args.renumber_start = 1
+
+    if args.renumber_start and not args.renumber:
+        raise EpRenameError('cannot specify `--renumber-start` without `--renumber`')
+
+    if args.watch:
+        if args.library:
+            raise EpRenameError('cannot specify both `--watch` and `--library`')
+        if args.renumber or args.skip or args.first or args.season_split:
+            raise EpRenameError('cannot specify `--watch` with `--renumber`, `--skip`, '
+                                + '`--first` or `--season-split` as new files would '
+                                + 'change the numbering of existing ones')
+
+def main():
+    args = argparser.parse_args()
+    try:
+        validate_args(args)
+    except EpRenameError as e:
+        argparser.error(str(e))
 
-if args.renumber and args.renumber_start is None:
-    args.renumber_start = 1
+    try:
+        if args.apply:
+            Program(args).apply_plan(args.apply)
+        elif args.library:
+            run_library(args)
+        elif args.manifest:
+            run_manifest(args)
+        else:
+            Program(args).run()
+    except EpRenameError as e:
+        print_error(args, e)
+        sys.exit(1)
 
-if args.renumber_start and not args.renumber:
-    argparser.error('cannot specify `--renumber-start` without `--renumber`')
+if __name__ == '__main__':
+    main()
 
-Program(args).run()